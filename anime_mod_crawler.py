@@ -1,19 +1,36 @@
  # -*- coding: utf-8 -*-
 
-from sys import exit
-from os import walk, makedirs, getcwd, sep
-from os.path import join, expanduser, split, isfile
+from os import walk, makedirs, getcwd, sep, scandir, stat, link, unlink
+from os.path import join, expanduser, split, isfile, normpath
 from shutil import copy as file_copy
+import shutil
+import os
+import sys
 import argparse
 import logging
 import re
-from Hoi4Converter.converter import *
-from Hoi4Converter.mappings import *
-import Hoi4Converter
+import json
+import struct
+import csv
+import io
+import zipfile
+import sqlite3
+import zlib
+import select
+import time
+import hashlib
+import unicodedata
+from collections import namedtuple, Counter, deque
+from filecmp import cmp as same_content
+from functools import partial
+from itertools import repeat, islice
+from threading import Lock
+from stat import S_ISSOCK
+from time import perf_counter
+import tempfile
+from bisect import bisect_right
 
 
-logging.basicConfig(filename='crawler.log', encoding='utf-8', level=logging.DEBUG)
-
 HOI4_ID = 394360
 # MAin Mods
 ROAD_TO_56_ID = 820260968
@@ -38,40 +55,120 @@ tag_list = {"road_to_56": ROAD_TO_56_ID,
             }
 
 
+# tags of tag_list which are main mods / anime mods
+MAIN_MOD_TAGS = ["road_to_56", "kaiserreich", "kaiserredux"]
+ANIME_MOD_TAGS = ["road_to_anime", "anime_history", "moereich", "moeredux",
+                  "anime_historia"]
+
+
+def resolve_mod_id(mod_id):
+    """
+    Gives the mod id for a tag from tag_list (other ids are kept)
+    """
+    if mod_id in tag_list.keys():
+        return tag_list[mod_id]
+    return mod_id
+
+
 
 
 GFX_PATH = 'gfx'
 FOLDERS_TO_CRAWL = {'leaders'}
 ROLES = ['leaders', 'ministers', 'advisors']
+NAME_PARTICLES = {'von', 'van', 'de', 'ter', 'du','el'}
+# particles which are ignored by the fuzzy matching
+FUZZY_PARTICLES = NAME_PARTICLES | {'la', 'le', 'del', 'della', 'da', 'di', 'der',
+                                    'den', 'zu', 'af', 'av', 'al', 'bin', 'ibn', 'y'}
+# words in file names which are not part of the name
+NAME_PREFIXES = {'portrait', 'portraits', 'leader', 'leaders', 'minister',
+                 'advisor', 'gfx', 'small', 'large'}
+TRANSLITERATION = str.maketrans({'ß': 'ss', 'ø': 'o', 'Ø': 'O', 'æ': 'ae',
+                                 'Æ': 'AE', 'œ': 'oe', 'Œ': 'OE', 'ł': 'l',
+                                 'Ł': 'L', 'đ': 'd', 'Đ': 'D', 'ı': 'i'})
 MISC_KEY = 'misc'
-desc = 'Find missing files. Supported Mod tags: \n'
-desc += ', '.join(tag_list.keys()) 
-desc += " (if the tag is not listed just provide the id as number)"
-
-parser = argparse.ArgumentParser(description=desc)
-parser.add_argument('mod_id', metavar='mod_id', type=str, nargs=1,
-                    help='Main mod to look at')
-parser.add_argument('anime_mod_id', metavar='anime_mod_id', type=str, nargs=1,
-                    help='Anime mod to look at')
-parser.add_argument('anime_mod_id_to_crawl', metavar='anime_mod_id_to_crawl',
-                    type=str, nargs='*',
-                    help='''Anime mod(s) to crawl. Either one or several. 
-                    If none is given anime_mod_id is used''',
-                    default=[],
-                    )
-arguments = parser.parse_args()
-
-# base = expanduser('~/.local/share/Steam/steamapps/workshop/content/')
-# hoi4_path = join(base, str(HOI4_ID))
-hoi4_path = getcwd()
-
-
+FILE_TYPES = [".png", ".dds"]
+IMAGE_HASH_SIZE = 8
+INDEX_CACHE_FILE = 'crawler_index.sqlite'
+# number of portraits which go through the crawl pipeline together
+BATCH_SIZE = 256
+LINK_MODES = ['copy', 'hardlink', 'reflink']
+FICLONE = 0x40049409  # Linux ioctl for reflinks
 def same_name(file1, file2, root1=None, root2=None):
     if file1.lower() == file2.lower():
         return True
     return False
 
 
+def _run_job(func, arg):
+    try:
+        return func(arg), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def run_jobs(func, args, jobs=1, pool=None):
+    """
+    Applies func to all args, with jobs > 1 in a process pool (a new one
+    or the given pool, which is left open).
+    Gives back (result, error) pairs in the order of args, so the
+    outcome is the same as in a serial run. An exception only
+    marks the failing argument.
+    """
+    args = list(args)
+    if jobs is None or jobs <= 1 or len(args) < 2:
+        for arg in args:
+            yield _run_job(func, arg)
+        return
+
+    chunksize = max(1, len(args) // (4 * jobs))
+    if pool is not None:
+        yield from pool.map(_run_job, repeat(func), args, chunksize=chunksize)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(_run_job, repeat(func), args, chunksize=chunksize)
+
+
+async def run_in_threads(executor, calls):
+    """
+    Runs the given functions (without arguments) at the same time in the
+    threads of executor and gives back their results in the same order
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*[loop.run_in_executor(executor, call)
+                                  for call in calls])
+
+
+def batched(iterable, size):
+    """
+    Splits an iterable into lists of (at most) size items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def name_key(file1):
+    """
+    Extracts the (lowercased) part of a file name which is assumed to be the
+    name of the person: the last two words, or three if there is a particle
+    like 'von' in front of the surname.
+    """
+    file1 = file1.replace("-","_")
+    parts = file1.split('_')
+    if len(parts) < 2:
+        return file1.lower()
+    if parts[-2].lower() in NAME_PARTICLES:
+        file1 = '_'.join(parts[-3:])
+    else:
+        file1 = '_'.join(parts[-2:])
+    return file1.lower()
+
+
 def contains_name(file1, file2, root1=None, root2=None):
     if root1 is not None and root2 is not None:
         for role in ROLES: 
@@ -79,52 +176,1777 @@ def contains_name(file1, file2, root1=None, root2=None):
                 if role not in root1:
                     return False
     
-    file1 = file1.replace("-","_")
     file2 = file2.replace("-","_")
-    parts = file1.split('_')
-    if parts[-2].lower() in {'von', 'van', 'de', 'ter', 'du','el'}:
-        file1 = '_'.join(parts[-3:])
-    else:
-        file1 = '_'.join(parts[-2:])
-    if file1.lower() in file2.lower():
+    if name_key(file1) in file2.lower():
         return True
     return False
 
+
+class Metrics:
+    """
+    Calls, wall time, files and bytes per stage of a crawl (walk, parse,
+    exists, match, validate, copy, report). Shared by everything created with the
+    same CrawlerConfig, stages can be counted from several threads.
+    """
+    STAGES = ['walk', 'parse', 'exists', 'match', 'validate', 'copy', 'report']
+
+    def __init__(self):
+        self.lock = Lock()
+        self.stages = {}
+
+    def add(self, stage, seconds=0.0, calls=1, files=0, size=0):
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {'calls': 0, 'seconds': 0.0,
+                                              'files': 0, 'bytes': 0}
+            entry['calls'] += calls
+            entry['seconds'] += seconds
+            entry['files'] += files
+            entry['bytes'] += size
+
+    def timed_iter(self, stage, iterable, count=None):
+        """
+        Goes through iterable and adds the time spent for the items (not
+        the time of the caller) to stage. count gives the number of files
+        of an item, by default 1.
+        """
+        iterator = iter(iterable)
+        seconds = 0.0
+        files = 0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds += perf_counter() - start
+                    return
+                seconds += perf_counter() - start
+                files += 1 if count is None else count(item)
+                yield item
+        finally:
+            self.add(stage, seconds, files=files)
+
+    def summary(self, caches=None):
+        """
+        Gives the stages (in the order of STAGES) and the hit rate of
+        the given caches {name: (hits, misses)} as dict for JSON
+        """
+        with self.lock:
+            stages = {stage: dict(self.stages[stage], seconds=round(self.stages[stage]['seconds'], 6))
+                      for stage in self.STAGES + sorted(set(self.stages) - set(self.STAGES))
+                      if stage in self.stages}
+        summary = {'stages': stages, 'caches': {}}
+        for name, (hits, misses) in (caches or {}).items():
+            total = hits + misses
+            summary['caches'][name] = {'hits': hits, 'misses': misses,
+                                       'hit_rate': round(hits / total, 4) if total > 0 else None}
+        return summary
+
+
+class IndexCache:
+    """
+    Persistent listing of the crawled mod folders (stored next to crawler.log).
+    For each directory the subfolders and the files with size and mtime are
+    kept. On the next walk only directories whose mtime changed are listed
+    again, unchanged ones are served from the cache.
+    Several mods can be walked at the same time from different threads.
+    """
+    def __init__(self, cache_file=INDEX_CACHE_FILE):
+        self.cache_file = cache_file
+        self.db = sqlite3.connect(cache_file, check_same_thread=False)
+        self.lock = Lock()
+        # directories taken from the cache / listed again
+        self.hits = 0
+        self.misses = 0
+        self.db.execute("""CREATE TABLE IF NOT EXISTS dirs (
+                           mod_path TEXT, path TEXT, mtime INTEGER,
+                           folders TEXT, files TEXT,
+                           PRIMARY KEY (mod_path, path))""")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def load(self, mod_path):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, mtime, folders, files FROM dirs WHERE mod_path = ?",
+                (mod_path,)).fetchall()
+        return {path: (mtime, json.loads(folders), json.loads(files))
+                for path, mtime, folders, files in rows}
+
+    @staticmethod
+    def list_dir(root):
+        """
+        Lists a directory like os.walk does. Folders are stored together
+        with a flag if walk would descend into them (no symlinks).
+        """
+        folders = []
+        files = []
+        with scandir(root) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    folders.append([entry.name, not entry.is_symlink()])
+                else:
+                    try:
+                        st = entry.stat()
+                        files.append([entry.name, st.st_size, st.st_mtime_ns])
+                    except OSError:
+                        files.append([entry.name, 0, 0])
+        return folders, files
+
+    def walk(self, mod_path):
+        """
+        Drop in replacement for os.walk(mod_path) which only lists
+        directories that changed since the last run.
+        """
+        cached = self.load(mod_path)
+        changed = {}
+        visited = set()
+        stack = ['']
+        rescanned = 0
+        while stack:
+            path = stack.pop()
+            root = join(mod_path, path) if path else mod_path
+            try:
+                mtime = stat(root).st_mtime_ns
+            except OSError:
+                continue
+            visited.add(path)
+            entry = cached.get(path)
+            if entry is None or entry[0] != mtime:
+                try:
+                    folders, files = self.list_dir(root)
+                except OSError:
+                    continue
+                changed[path] = (mtime, folders, files)
+                rescanned += 1
+            else:
+                _, folders, files = entry
+
+            yield root, [f[0] for f in folders], [f[0] for f in files]
+            # reversed, so the folders are visited in the same order as walk
+            stack.extend(join(path, name) if path else name
+                         for name, follow in reversed(folders) if follow)
+
+        logging.info(f"Walked {mod_path}: {len(visited)} directories, {rescanned} rescanned\n")
+        self.hits += len(visited) - rescanned
+        self.misses += rescanned
+        with self.lock:
+            self.db.executemany("REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)",
+                                [(mod_path, path, mtime, json.dumps(folders), json.dumps(files))
+                                 for path, (mtime, folders, files) in changed.items()])
+            self.db.executemany("DELETE FROM dirs WHERE mod_path = ? AND path = ?",
+                                [(mod_path, path) for path in cached.keys() - visited])
+            self.db.commit()
+
+
+class ParseCache:
+    """
+    Results of parsed files (character files, .gfx files) keyed by path,
+    size and mtime. The results are stored as compressed JSON next to the
+    directory listings, so only files which changed are parsed again.
+    """
+    def __init__(self, cache_file=INDEX_CACHE_FILE):
+        self.cache_file = cache_file
+        self.db = sqlite3.connect(cache_file, check_same_thread=False)
+        self.lock = Lock()
+        self.db.execute("""CREATE TABLE IF NOT EXISTS parsed (
+                           kind TEXT, path TEXT, size INTEGER, mtime INTEGER,
+                           data BLOB, PRIMARY KEY (kind, path))""")
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.db.close()
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    @staticmethod
+    def encode(result):
+        return zlib.compress(json.dumps(result, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def decode(data):
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+    def parse(self, kind, func, paths, jobs=1, pool=None, commit=True):
+        """
+        Same as run_jobs(func, paths, jobs, pool), but the results of
+        unchanged files are taken from the cache. kind separates different
+        parsers. The results are given one by one as they come (only the
+        sizes and mtimes are looked up first), the new ones are committed
+        at the end (with commit=False by the next commit).
+        """
+        paths = list(paths)
+        todo = []
+        for path in paths:
+            try:
+                st = stat(path)
+            except OSError:
+                todo.append((path, None))
+                continue
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT size, mtime FROM parsed WHERE kind = ? AND path = ?",
+                    (kind, path)).fetchone()
+            if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+                todo.append((path, st))
+        self.hits += len(paths) - len(todo)
+        self.misses += len(todo)
+
+        pending = {path: st for path, st in todo}
+        parsed = run_jobs(func, [path for path, st in todo], jobs, pool)
+        try:
+            for path in paths:
+                if path not in pending:
+                    with self.lock:
+                        row = self.db.execute(
+                            "SELECT data FROM parsed WHERE kind = ? AND path = ?",
+                            (kind, path)).fetchone()
+                    yield self.decode(row[0]), None
+                    continue
+                st = pending[path]
+                result, error = next(parsed)
+                if error is None and st is not None:
+                    with self.lock:
+                        self.db.execute("REPLACE INTO parsed VALUES (?, ?, ?, ?, ?)",
+                                        (kind, path, st.st_size, st.st_mtime_ns,
+                                         self.encode(result)))
+                yield result, error
+        finally:
+            parsed.close()
+            if commit:
+                self.commit()
+            logging.info(f"Parsed {len(todo)} {kind} files, {len(paths) - len(todo)} from cache\n")
+
+
+def strip_prefix(path, prefix):
+    """
+    path without prefix (unchanged if it does not start with it)
+    """
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    return path
+
+
+class PathTable:
+    """
+    Interned folders (relative to their mod) of all crawled mods. Files are
+    kept as ModPath records pointing into this table, full paths are only
+    put together when they are needed to read or write something.
+    """
+    def __init__(self, hoi4_path):
+        self.hoi4_path = hoi4_path
+        self.dirs = ['']
+        self.ids = {'': 0}
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.dirs)
+
+    def intern(self, rel_dir):
+        dir_id = self.ids.get(rel_dir)
+        if dir_id is None:
+            with self.lock:
+                dir_id = self.ids.get(rel_dir)
+                if dir_id is None:
+                    dir_id = self.ids[rel_dir] = len(self.dirs)
+                    self.dirs.append(rel_dir)
+        return dir_id
+
+    def split(self, folder):
+        """
+        (mod folder, folder id) of a folder inside hoi4_path, None for
+        folders somewhere else
+        """
+        prefix = self.hoi4_path + sep
+        if not folder.startswith(prefix):
+            return None
+        mod, _, rel = folder[len(prefix):].partition(sep)
+        return mod, self.intern(rel)
+
+    def folder(self, mod, dir_id):
+        mod_path = join(self.hoi4_path, str(mod))
+        rel = self.dirs[dir_id]
+        return join(mod_path, rel) if rel else mod_path
+
+    def swap_mod(self, folder, mod, old_mod):
+        """
+        The same folder inside another mod (only the mod part changes).
+        Folders outside of hoi4_path get the last path part equal to old_mod
+        swapped. Raises ValueError if the folder isn't inside old_mod.
+        """
+        old_mod = str(old_mod)
+        parts = self.split(folder)
+        if parts is not None:
+            if parts[0] != old_mod:
+                raise ValueError(f"{folder} is not inside mod {old_mod}")
+            return self.folder(mod, parts[1])
+        names = folder.split(sep)
+        if old_mod not in names:
+            raise ValueError(f"{folder} is not inside mod {old_mod}")
+        names[len(names) - 1 - names[::-1].index(old_mod)] = str(mod)
+        return sep.join(names)
+
+
+class ModPath:
+    """
+    A file of a mod as (mod folder, interned folder id, stem, extension),
+    see PathTable.
+    """
+    __slots__ = ('mod', 'dir_id', 'stem', 'ext')
+
+    def __init__(self, mod, dir_id, stem, ext):
+        self.mod = mod
+        self.dir_id = dir_id
+        self.stem = stem
+        self.ext = ext
+
+    def __repr__(self):
+        return f"ModPath({self.mod!r}, {self.dir_id}, {self.stem!r}, {self.ext!r})"
+
+    @property
+    def file(self):
+        return self.stem + self.ext
+
+
+def file_hash(path):
+    """
+    SHA-1 of the content of a file (None if it can't be read)
+    """
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(partial(f.read, 1 << 20), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def file_key(path):
+    """
+    Size and mtime of a file as the ParseCache compares them (None if
+    it is gone), the file is not read
+    """
+    try:
+        st = stat(path)
+    except OSError:
+        return None
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def criteria_key(criteria):
+    """
+    Name of a criteria including its settings (e.g. the fuzzy threshold)
+    """
+    name = getattr(criteria, '__name__', type(criteria).__name__)
+    settings = sorted((key, value) for key, value in vars(criteria).items()
+                      if isinstance(value, (int, float, str))) if hasattr(criteria, '__dict__') else []
+    if len(settings) == 0:
+        return name
+    return name + '(' + ','.join(f"{key}={value}" for key, value in settings) + ')'
+
+
+def default_suffixes(count):
+    """
+    Suffixes for the files of count crawled mods: none for the first
+    mod, _v{k} for the k-th one
+    """
+    return [f"_v{k}" if k > 0 else '' for k in range(count)]
+
+
+class RunManifest:
+    """
+    What the last crawl with the same mods, file types and criteria did:
+    the keys of the inputs (size and mtime of the character files, hashes
+    of the file lists of the crawled mods), the match chosen in every crawled mod for each missing
+    portrait and the copied files. It is stored next to the caches.
+    The file lists of the crawled mods are kept too, so on a rerun only
+    the files added or removed since are known (see add_index) and
+    portraits which none of them fits take the match from here instead
+    of searching again. Only the changes to the last run are reported.
+    """
+    def __init__(self, cache_file, run):
+        self.cache_file = cache_file
+        self.run = run
+        self.db = sqlite3.connect(cache_file, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS manifest_inputs (
+                           run TEXT, name TEXT, hash TEXT, PRIMARY KEY (run, name))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS manifest_matches (
+                           run TEXT, path TEXT, file_type TEXT, matches TEXT,
+                           PRIMARY KEY (run, path))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS manifest_outputs (
+                           run TEXT, dst TEXT, src TEXT, PRIMARY KEY (run, dst))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS manifest_indexes (
+                           run TEXT, name TEXT, files TEXT, PRIMARY KEY (run, name))""")
+        self.db.commit()
+        self.inputs = dict(self.db.execute(
+            "SELECT name, hash FROM manifest_inputs WHERE run = ?", (run,)))
+        # path -> (file_type, [(root, file) or (None, None) per crawled mod])
+        self.matches = {path: (file_type, [tuple(match) for match in json.loads(matches)])
+                        for path, file_type, matches in self.db.execute(
+                            "SELECT path, file_type, matches FROM manifest_matches WHERE run = ?",
+                            (run,))}
+        self.outputs = dict(self.db.execute(
+            "SELECT dst, src FROM manifest_outputs WHERE run = ?", (run,)))
+        self.new_inputs = {}
+        self.new_matches = {}
+        self.new_outputs = {}
+        self.new_indexes = {}
+        self.reused = 0
+
+    def close(self):
+        self.db.close()
+
+    def add_input(self, name, value):
+        """
+        Records the key of an input (changed inputs are reported)
+        """
+        self.new_inputs[name] = value
+
+    def add_index(self, name, files):
+        """
+        Records the file list of a crawled mod (in walk order) and gives
+        back the files added or removed since the last run, or None if
+        all matches in it have to be searched again (no list of the last
+        run, or the files are walked in another order)
+        """
+        files = '\n'.join(files)
+        self.new_indexes[name] = files
+        self.add_input(name, hashlib.sha1(files.encode('utf-8')).hexdigest())
+        row = self.db.execute("SELECT files FROM manifest_indexes WHERE run = ? AND name = ?",
+                              (self.run, name)).fetchone()
+        if row is None:
+            return None
+        if row[0] == files:
+            return set()
+        old, new = row[0].split('\n'), files.split('\n')
+        changed = set(old).symmetric_difference(new)
+        if len(changed) == 0:
+            return None
+        old_set = set(old)
+        if [file for file in new if file in old_set] != [file for file in old if file not in changed]:
+            return None
+        return changed
+
+    def changed_inputs(self):
+        return sorted(name for name in self.inputs.keys() | self.new_inputs.keys()
+                      if self.inputs.get(name) != self.new_inputs.get(name))
+
+    def previous_matches(self, path, file_type, valid=None):
+        """
+        Gives the matches of the last run for a portrait (None if there
+        are none or valid(path, file_type) says they are out of date)
+        """
+        previous = self.matches.get(path)
+        if previous is None or previous[0] != file_type:
+            return None
+        if valid is not None and not valid(path, file_type):
+            return None
+        self.reused += 1
+        return previous[1]
+
+    def add_match(self, path, file_type, matches):
+        self.new_matches[path] = (file_type, matches)
+
+    def add_output(self, dst, src):
+        self.new_outputs[dst] = src
+
+    def delta(self):
+        """
+        Changes to the last run: portraits which are missing now or not
+        any more, portraits with another match, outputs which are new or
+        not made any more and the inputs which changed
+        """
+        old, new = self.matches, self.new_matches
+        return {'added': sorted(new.keys() - old.keys()),
+                'removed': sorted(old.keys() - new.keys()),
+                'changed': sorted(path for path in new.keys() & old.keys()
+                                  if [list(m) for m in old[path][1]] != [list(m) for m in new[path][1]]),
+                'new_outputs': sorted(dst for dst in self.new_outputs.keys() - self.outputs.keys()),
+                'removed_outputs': sorted(self.outputs.keys() - self.new_outputs.keys()),
+                'inputs': self.changed_inputs()}
+
+    def save(self):
+        self.db.execute("DELETE FROM manifest_inputs WHERE run = ?", (self.run,))
+        self.db.execute("DELETE FROM manifest_matches WHERE run = ?", (self.run,))
+        self.db.execute("DELETE FROM manifest_outputs WHERE run = ?", (self.run,))
+        self.db.execute("DELETE FROM manifest_indexes WHERE run = ?", (self.run,))
+        self.db.executemany("INSERT INTO manifest_inputs VALUES (?, ?, ?)",
+                            [(self.run, name, value) for name, value in self.new_inputs.items()])
+        self.db.executemany("INSERT INTO manifest_matches VALUES (?, ?, ?, ?)",
+                            [(self.run, path, file_type, json.dumps(matches))
+                             for path, (file_type, matches) in self.new_matches.items()])
+        self.db.executemany("INSERT INTO manifest_outputs VALUES (?, ?, ?)",
+                            [(self.run, dst, src) for dst, src in self.new_outputs.items()])
+        self.db.executemany("INSERT INTO manifest_indexes VALUES (?, ?, ?)",
+                            [(self.run, name, files) for name, files in self.new_indexes.items()])
+        self.db.commit()
+
+
+class ModSnapshot:
+    """
+    All files of a mod (relative to the mod folder), listed once.
+    Existence checks are set lookups instead of one stat call per file.
+    """
+    def __init__(self, mod_path, walker=walk):
+        self.mod_path = mod_path
+        self.files = set()
+        prefix = len(mod_path) + 1
+        for root, folders, files in walker(mod_path):
+            rel = root[prefix:]
+            self.files.update(normpath(join(rel, file)) for file in files)
+        logging.info(f"Snapshot of {mod_path}: {len(self.files)} files\n")
+
+    def __contains__(self, rel_path):
+        return normpath(rel_path) in self.files
+
+    def full_paths(self, ext):
+        """
+        Full paths of the files with the file type ext (in any case)
+        """
+        return [join(self.mod_path, path) for path in self.files
+                if path.lower().endswith(ext)]
+
+    def missing(self, rel_paths):
+        """
+        Gives back the set of the relative paths which are not in the mod
+        """
+        return {normpath(path) for path in rel_paths} - self.files
+
+
+def reflink(src, dst):
+    """
+    Copy on write clone of src (Linux, e.g. btrfs or xfs)
+    """
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+class CopyPlan:
+    """
+    Files to copy, collected while matching and written by a thread pool.
+    Once max_pending files are planned they are handed to the writer
+    threads while matching goes on; run() writes the rest and waits.
+    The folders are created once per batch.
+    Files already there with the same content are skipped (the writers
+    check that, so matching does not wait for the disk), files left from
+    an earlier run with other content are replaced. A destination taken
+    by another source in this run is written to alt_dst instead. With
+    link='hardlink' or 'reflink' the file is linked instead of copied if
+    source and destination are on the same file system.
+    """
+    def __init__(self, jobs=4, link='copy', max_pending=1000, metrics=None):
+        if link not in LINK_MODES:
+            raise ValueError(f"Unknown link mode {link}!")
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.jobs = jobs
+        self.link = link
+        self.max_pending = max_pending
+        # destination -> source of the files not handed to the writers yet
+        self.plan = {}
+        # destination -> source of every file planned in this run
+        self.claimed = {}
+        self.futures = set()
+        self.pool = None
+        self.lock = Lock()
+        self.errors = []
+        self.copied = 0
+        self.linked = 0
+        self.skipped = 0
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.plan)
+
+    @staticmethod
+    def is_same_file(src, dst):
+        try:
+            if stat(src).st_size != stat(dst).st_size:
+                return False
+            return same_content(src, dst, shallow=False)
+        except OSError:
+            return False
+
+    def add(self, src, dst, alt_dst=None):
+        """
+        Plans to copy src to dst. If dst is already planned for another
+        file alt_dst is used instead.
+        Gives back the destination src is written to (also if it was
+        planned before) or None if both are taken by other files.
+        """
+        if alt_dst is None:
+            alt_dst = dst
+        for target in dict.fromkeys([dst, alt_dst]):
+            claimed = self.claimed.get(target)
+            if claimed == src:
+                return target
+            if claimed is None:
+                self.claimed[target] = src
+                self.plan[target] = src
+                if len(self.plan) >= self.max_pending:
+                    self.flush()
+                return target
+        logging.info(f"{alt_dst} is already taken, {src} is not copied\n")
+        return None
+
+    def write(self, item):
+        start = perf_counter()
+        status, size = self.write_file(item)
+        self.metrics.add('copy', perf_counter() - start,
+                         files=int(status != 'skipped'), size=size)
+        return status, size
+
+    def write_file(self, item):
+        dst, src = item
+        if isfile(dst):
+            if self.is_same_file(src, dst):
+                return 'skipped', 0
+            # never write into the old file, it may be a link into an anime mod
+            unlink(dst)
+
+        if self.link != 'copy':
+            try:
+                if stat(src).st_dev == stat(split(dst)[0]).st_dev:
+                    if self.link == 'hardlink':
+                        link(src, dst)
+                    else:
+                        reflink(src, dst)
+                    return 'linked', 0
+            except (OSError, ImportError) as e:
+                logging.info(f"Could not {self.link} {src}: {e}\n")
+
+        file_copy(src, dst)
+        return 'copied', stat(dst).st_size
+
+    def done(self, dst, future):
+        with self.lock:
+            try:
+                status, size = future.result()
+            except OSError as e:
+                logging.info(f"Could not write {dst}: {e}\n")
+                self.errors.append((dst, str(e)))
+                return
+            if status == 'copied':
+                self.copied += 1
+            elif status == 'linked':
+                self.linked += 1
+            else:
+                self.skipped += 1
+            self.bytes += size
+
+    def flush(self):
+        """
+        Hands the planned files to the writer threads without waiting
+        for them (only if too many are still in flight)
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        plan, self.plan = self.plan, {}
+        if len(plan) == 0:
+            return
+        for folder in sorted({split(dst)[0] for dst in plan}):
+            makedirs(folder, exist_ok=True)
+
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=max(1, self.jobs))
+        for dst, src in plan.items():
+            while len(self.futures) >= 2 * self.max_pending:
+                _, self.futures = wait(self.futures, return_when=FIRST_COMPLETED)
+            future = self.pool.submit(self.write, (dst, src))
+            future.add_done_callback(partial(self.done, dst))
+            self.futures.add(future)
+
+    def run(self):
+        """
+        Writes all planned files and waits for the writers
+        """
+        self.flush()
+        self.claimed = {}
+        if self.pool is None:
+            return
+        self.pool.shutdown(wait=True)
+        self.pool = None
+        self.futures = set()
+        logging.info(f"Copied {self.copied}, linked {self.linked}, skipped {self.skipped} files ({self.bytes} bytes)\n")
+
+
+class ReportWriter:
+    """
+    Writes a list of files grouped by role (see ROLES) in one pass.
+    Every file is sorted into its role when it is written and kept in a
+    temporary file per role; the sections are put together on close.
+    """
+    def __init__(self, file_name, base_path, metrics=None):
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.seconds = 0.0
+        self.size = 0
+        self.file_name = file_name
+        self.prefix = base_path + sep
+        self.sections = {key: tempfile.TemporaryFile('w+', encoding='utf-8')
+                         for key in ROLES + [MISC_KEY]}
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, file_path):
+        start = perf_counter()
+        line = strip_prefix(file_path, self.prefix) + '\n'
+        roles = [role for role in ROLES if '/'+role+'/' in line]
+        if len(roles) == 0:
+            roles = [MISC_KEY]
+        for role in roles:
+            self.sections[role].write(line)
+            self.size += len(line)
+        self.count += 1
+        self.seconds += perf_counter() - start
+
+    def close(self):
+        if self.sections is None:
+            return
+        start = perf_counter()
+        with open(self.file_name, 'w', encoding='utf-8') as filep:
+            for key, section in self.sections.items():
+                filep.write(f"\n{key}:\n")
+                section.seek(0)
+                shutil.copyfileobj(section, filep)
+                section.close()
+        self.sections = None
+        self.metrics.add('report', self.seconds + perf_counter() - start,
+                         files=self.count, size=self.size)
+
+
+SPRITE_FILE = "interface/anime_portraits.gfx"
+DESCRIPTOR_FILE = "descriptor.mod"
+
+
+def mod_name(mod_path):
+    """
+    Name of a mod as given in its descriptor.mod (else the folder name)
+    """
+    try:
+        with open(join(mod_path, DESCRIPTOR_FILE), 'r', encoding='utf-8') as filep:
+            found = re.search(r'^\s*name\s*=\s*"([^"]*)"', filep.read(), re.MULTILINE)
+    except OSError:
+        found = None
+    if found is None:
+        return split(mod_path)[1]
+    return found.group(1)
+
+
+class ModPackage:
+    """
+    Writes the found portraits straight into a submod (a folder, or a zip
+    file if path ends with .zip) instead of the diff folders. It is used
+    as the copy plan of a crawler: every file is written (or added to the
+    zip) as soon as it is found, files with the same content are written
+    once and the others point to it (see target).
+    close writes the sprite definitions, character file overrides and
+    the descriptor.mod.
+    """
+    def __init__(self, path, config=None):
+        if config is None:
+            config = CrawlerConfig(use_cache=False)
+        self.path = path
+        self.prefix = config.hoi4_path + sep
+        self.metrics = config.metrics
+        self.zip = None
+        if path.endswith('.zip'):
+            self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            makedirs(path, exist_ok=True)
+        self.lock = Lock()
+        # path in the package -> source
+        self.entries = {}
+        # path in the package -> path of the file with the same content
+        self.aliases = {}
+        # content hash -> path in the package
+        self.contents = {}
+        self.errors = []
+        self.written = 0
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def arcname(self, dst):
+        """
+        Path in the package of a destination inside the output mod folder
+        """
+        rel = strip_prefix(dst, self.prefix).split(sep, 1)[-1]
+        return rel.replace(sep, '/')
+
+    def target(self, rel_path):
+        """
+        Path in the package which has the content for rel_path (None if
+        it is not in the package)
+        """
+        rel_path = rel_path.replace(sep, '/')
+        if rel_path in self.aliases:
+            return self.aliases[rel_path]
+        if rel_path in self.entries:
+            return rel_path
+        return None
+
+    def add(self, src, dst, alt_dst=None):
+        """
+        Same as CopyPlan.add, but the file is written right away
+        """
+        if alt_dst is None:
+            alt_dst = dst
+        with self.lock:
+            arcname = self.arcname(dst)
+            planned = self.entries.get(arcname)
+            if planned is not None:
+                if planned == src:
+                    return dst
+                dst = alt_dst
+                arcname = self.arcname(dst)
+                planned = self.entries.get(arcname)
+                if planned is not None:
+                    return dst if planned == src else None
+            self.entries[arcname] = src
+            digest = file_hash(src)
+            if digest is not None and digest in self.contents:
+                self.aliases[arcname] = self.contents[digest]
+                return dst
+            try:
+                self.write(src, arcname)
+            except OSError as e:
+                logging.info(f"Could not write {arcname}: {e}\n")
+                self.errors.append((arcname, str(e)))
+                del self.entries[arcname]
+                return None
+            if digest is not None:
+                self.contents[digest] = arcname
+            return dst
+
+    def write(self, src, arcname):
+        start = perf_counter()
+        if self.zip is not None:
+            # images are compressed already
+            compress = zipfile.ZIP_STORED if arcname.endswith('.png') else zipfile.ZIP_DEFLATED
+            self.zip.write(src, arcname, compress_type=compress)
+        else:
+            dst = join(self.path, arcname)
+            makedirs(split(dst)[0], exist_ok=True)
+            file_copy(src, dst)
+        size = stat(src).st_size
+        self.written += 1
+        self.bytes += size
+        self.metrics.add('copy', perf_counter() - start, files=1, size=size)
+
+    def open(self, arcname):
+        """
+        Text file in the package to write to
+        """
+        if self.zip is not None:
+            return io.TextIOWrapper(self.zip.open(arcname, 'w'), encoding='utf-8')
+        dst = join(self.path, arcname)
+        makedirs(split(dst)[0], exist_ok=True)
+        return open(dst, 'w', encoding='utf-8')
+
+    def run(self):
+        """
+        Nothing to wait for, the files are written when they are added
+        """
+        logging.info(f"Packaged {self.written} files ({self.bytes} bytes), "
+                     f"{len(self.aliases)} duplicates\n")
+
+    def write_sprites(self, sprites):
+        """
+        Writes the sprite definitions for (name, texturefile), every name once.
+        Gives back the number of sprites.
+        """
+        seen = set()
+        with self.open(SPRITE_FILE) as filep:
+            filep.write("spriteTypes = {\n")
+            for name, texturefile in sprites:
+                if name in seen:
+                    continue
+                seen.add(name)
+                filep.write(f'\tSpriteType = {{\n\t\tname = "{name}"\n'
+                            f'\t\ttexturefile = "{texturefile}"\n\t}}\n')
+            filep.write("}\n")
+        return len(seen)
+
+    def write_override(self, src, arcname, replacements):
+        """
+        Writes the file src to arcname with the quoted paths replaced
+        (line by line)
+        """
+        with open(src, 'r', encoding='utf-8') as org, self.open(arcname) as filep:
+            for line in org:
+                for old, new in replacements.items():
+                    if old in line:
+                        line = line.replace(f'"{old}"', f'"{new}"')
+                filep.write(line)
+
+    def close(self, name="Anime portraits", dependencies=()):
+        """
+        Writes the descriptor.mod and finishes the package
+        """
+        if self.entries is None:
+            return
+        with self.open(DESCRIPTOR_FILE) as filep:
+            filep.write(f'name="{name}"\nversion="1.0"\ntags={{\n\t"Graphics"\n}}\n')
+            if len(dependencies) > 0:
+                filep.write("dependencies={\n")
+                filep.writelines(f'\t"{dependency}"\n' for dependency in dependencies)
+                filep.write("}\n")
+        if self.zip is not None:
+            self.zip.close()
+        logging.info(f"Wrote package {self.path}\n")
+        self.entries = None
+
+
+def list_walk(mod_path, rel_paths):
+    """
+    Gives (root, folders, files) like walk, but only for the given paths
+    relative to mod_path
+    """
+    folders = {}
+    for rel_path in rel_paths:
+        folder, file = split(rel_path)
+        folders.setdefault(folder, []).append(file)
+    for folder, files in folders.items():
+        yield (join(mod_path, folder) if folder else mod_path), [], files
+
+
+class ModIndex:
+    """
+    In-memory index of all files of a given type inside a mod.
+    Files are kept in walk order, so every lookup gives the same result as
+    walking through the mod and taking the first file which fits.
+    """
+    def __init__(self, mod_path, file_type, walker=walk, paths=None):
+        if paths is None:
+            paths = PathTable(split(mod_path)[0])
+        self.mod_path = mod_path
+        self.mod = split(mod_path)[1]
+        self.file_type = file_type
+        self.walker = walker
+        self.paths = paths
+        # ModPath records in walk order
+        self.entries = []
+        # folder id -> roles of the folder
+        self.roles = {}
+        # lowercased stem -> first entry
+        self.by_stem = {}
+        # name key (see name_key) -> entries
+        self.by_key = {}
+        # lowercased stems joined by newlines for fast substring search
+        self.names = ''
+        self.offsets = []
+        self.build()
+
+    def build(self):
+        names = []
+        offset = 0
+        prefix = len(self.mod_path) + 1
+        for root, folders, files in self.walker(self.mod_path):
+            dir_id = self.paths.intern(root[prefix:])
+            self.roles[dir_id] = tuple(role for role in ROLES if role in root)
+            for file in files:
+                if not file.endswith(self.file_type):
+                    continue
+                stem = file[:-len(self.file_type)]
+                idx = len(self.entries)
+                self.entries.append(ModPath(self.mod, dir_id, stem, self.file_type))
+                self.by_stem.setdefault(stem.lower(), idx)
+                self.by_key.setdefault(name_key(stem), []).append(idx)
+                name = stem.replace("-","_").lower()
+                names.append(name)
+                self.offsets.append(offset)
+                offset += len(name) + 1
+        self.names = '\n'.join(names)
+        logging.info(f"Indexed {len(self.entries)} files in {self.mod_path}\n")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def root(self, idx):
+        """
+        Folder of an entry (as full path)
+        """
+        rel = self.paths.dirs[self.entries[idx].dir_id]
+        return join(self.mod_path, rel) if rel else self.mod_path
+
+    def location(self, idx):
+        return self.root(idx), self.entries[idx].file
+
+    def entry_roles(self, idx):
+        return self.roles[self.entries[idx].dir_id]
+
+    def files(self):
+        """
+        Paths of the indexed files relative to the mod, in walk order
+        """
+        for entry in self.entries:
+            yield join(self.paths.dirs[entry.dir_id], entry.file)
+
+    @staticmethod
+    def fits_role(roles, root1):
+        """
+        Same role check as in contains_name
+        """
+        if root1 is None:
+            return True
+        return all(role in root1 for role in roles)
+
+    def find_same_name(self, stem):
+        return self.by_stem.get(stem.lower())
+
+    def find_containing(self, stem, root1=None):
+        """
+        First file (in walk order) which contains the name key of stem.
+        The key index gives a candidate, the substring search over the
+        names only has to check the files before it.
+        """
+        key = name_key(stem)
+        if len(key) == 0:
+            return None
+        found = None
+        limit = len(self.names)
+        for idx in self.by_key.get(key, []):
+            if self.fits_role(self.entry_roles(idx), root1):
+                found = idx
+                limit = self.offsets[idx]
+                break
+
+        start = 0
+        while True:
+            pos = self.names.find(key, start, limit)
+            if pos < 0:
+                return found
+            idx = bisect_right(self.offsets, pos) - 1
+            if self.fits_role(self.entry_roles(idx), root1):
+                return idx
+            if idx + 1 >= len(self.offsets):
+                return found
+            start = self.offsets[idx + 1]
+
+    def find(self, stem, criteria, root1=None):
+        """
+        Index of the first file which fits the criteria (or None)
+        """
+        if criteria is same_name:
+            return self.find_same_name(stem)
+        if criteria is contains_name:
+            return self.find_containing(stem, root1)
+        if hasattr(criteria, 'find_in_index'):
+            return criteria.find_in_index(self, stem, root1)
+        for idx, entry in enumerate(self.entries):
+            if criteria(stem, entry.stem, root1, self.root(idx)) is True:
+                return idx
+        return None
+
+    def iter_names(self, key):
+        """
+        Entries whose name contains key, in walk order
+        """
+        if len(key) == 0:
+            return
+        start = 0
+        while True:
+            pos = self.names.find(key, start)
+            if pos < 0:
+                return
+            idx = bisect_right(self.offsets, pos) - 1
+            yield idx
+            if idx + 1 >= len(self.offsets):
+                return
+            start = self.offsets[idx + 1]
+
+    def find_all(self, stem, criteria, root1=None):
+        """
+        Generator over all files which fit the criteria, the one find
+        gives first
+        """
+        if criteria is same_name:
+            lstem = stem.lower()
+            for idx in self.iter_names(stem.replace("-","_").lower()):
+                if self.entries[idx].stem.lower() == lstem:
+                    yield idx
+        elif criteria is contains_name:
+            for idx in self.iter_names(name_key(stem)):
+                if self.fits_role(self.entry_roles(idx), root1):
+                    yield idx
+        elif hasattr(criteria, 'candidates'):
+            for _, idx in criteria.candidates(self, stem, root1):
+                yield idx
+        else:
+            for idx, entry in enumerate(self.entries):
+                if criteria(stem, entry.stem, root1, self.root(idx)) is True:
+                    yield idx
+
+def scan_mod(mod_path, file_types=(), snapshot=True, walker=walk, paths=None):
+    """
+    Walks a mod once and builds its ModSnapshot (if snapshot) and the
+    ModIndex of every file type from that listing.
+    Gives back (snapshot or None, {file_type: ModIndex}).
+    """
+    tree = list(walker(mod_path))
+
+    def listing(path):
+        return iter(tree)
+
+    found = ModSnapshot(mod_path, walker=listing) if snapshot else None
+    return found, {file_type: ModIndex(mod_path, file_type, walker=listing, paths=paths)
+                   for file_type in file_types}
+
+
+def normalize_name(stem):
+    """
+    Normalizes a file name for fuzzy matching: transliterates to ascii,
+    drops prefixes like Portrait_MEX_, numbering and noble particles and
+    gives back the last two words (which are assumed to be the name).
+    """
+    name = unicodedata.normalize('NFKD', stem.translate(TRANSLITERATION))
+    name = name.encode('ascii', 'ignore').decode('ascii')
+    words = re.split(r'[_\-\s.]+', name)
+    result = []
+    after_prefix = False
+    for word in words:
+        lword = word.lower()
+        if lword in NAME_PREFIXES:
+            after_prefix = True
+            continue
+        # country tags like MEX or D01, only right after the prefix
+        # (names like LEE or KIM are kept)
+        is_tag = after_prefix and re.fullmatch(r'[A-Z][A-Z0-9]{2}', word)
+        after_prefix = False
+        if (len(word) == 0 or is_tag or lword in FUZZY_PARTICLES
+                or lword.isdigit() or re.fullmatch(r'v\d+', lword)):
+            continue
+        result.append(lword)
+    return ' '.join(result[-2:])
+
+
+def ngrams(name, n=3):
+    """
+    Character n-grams of a normalized name (none for an empty name, so
+    it never matches anything)
+    """
+    if len(name) == 0:
+        return set()
+    name = f' {name} '
+    return {name[i:i + n] for i in range(max(1, len(name) - n + 1))}
+
+
+class FuzzyMatcher:
+    """
+    Fuzzy name matching which can be used as criteria.
+    The names are normalized (see normalize_name) and compared by the
+    Dice coefficient of their character trigrams. For a ModIndex the
+    trigrams of all files are indexed once, so a lookup only looks at
+    files which share at least one trigram with the name.
+    """
+    def __init__(self, threshold=0.8, n=3):
+        self.threshold = threshold
+        self.n = n
+        # id(ModIndex) -> (ModIndex, trigram sizes, trigram -> entries)
+        self.ngram_indexes = {}
+
+    def score(self, file1, file2):
+        grams1 = ngrams(normalize_name(file1), self.n)
+        grams2 = ngrams(normalize_name(file2), self.n)
+        if len(grams1) == 0 or len(grams2) == 0:
+            return 0.0
+        return 2 * len(grams1 & grams2) / (len(grams1) + len(grams2))
+
+    def __call__(self, file1, file2, root1=None, root2=None):
+        if root1 is not None and root2 is not None:
+            for role in ROLES:
+                if role in root2 and role not in root1:
+                    return False
+        return self.score(file1, file2) >= self.threshold
+
+    def get_ngram_index(self, index):
+        if id(index) not in self.ngram_indexes:
+            sizes = []
+            postings = {}
+            for idx, entry in enumerate(index.entries):
+                grams = ngrams(normalize_name(entry.stem), self.n)
+                sizes.append(len(grams))
+                for gram in grams:
+                    postings.setdefault(gram, []).append(idx)
+            self.ngram_indexes[id(index)] = (index, sizes, postings)
+        return self.ngram_indexes[id(index)]
+
+    def candidates(self, index, stem, root1=None, limit=None):
+        """
+        Gives back [(score, entry)] of the files in the index which reach
+        the threshold, best first (and in walk order for equal scores).
+        """
+        _, sizes, postings = self.get_ngram_index(index)
+        grams = ngrams(normalize_name(stem), self.n)
+        common = Counter()
+        for gram in grams:
+            common.update(postings.get(gram, ()))
+
+        ranked = []
+        for idx, count in common.items():
+            score = 2 * count / (len(grams) + sizes[idx])
+            if score >= self.threshold and index.fits_role(index.entry_roles(idx), root1):
+                ranked.append((score, idx))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return ranked
+
+    def forget(self, indexes):
+        """
+        Drops the trigrams of indexes which are not used any more
+        """
+        for index in indexes:
+            self.ngram_indexes.pop(id(index), None)
+
+    def find_in_index(self, index, stem, root1=None):
+        ranked = self.candidates(index, stem, root1, limit=1)
+        if len(ranked) == 0:
+            return None
+        return ranked[0][1]
+
+
+def dct_matrix(n):
+    import numpy as np
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    m[0] /= np.sqrt(2)
+    return m
+
+
+def image_hash(path, hash_size=IMAGE_HASH_SIZE, scale=4):
+    """
+    Perceptual hash of an image (.png or .dds): the signs of the low
+    frequencies of the DCT of the shrunk grayscale image, as int.
+    """
+    import numpy as np
+    from PIL import Image
+    size = hash_size * scale
+    with Image.open(path) as img:
+        img = img.convert('L').resize((size, size), Image.BILINEAR)
+        pixels = np.asarray(img, dtype=np.float64)
+    dct = dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(hash1, hash2):
+    return bin(hash1 ^ hash2).count('1')
+
+
+class BKTree:
+    """
+    BK-tree over image hashes for nearest neighbour search by
+    Hamming distance.
+    """
+    def __init__(self):
+        # [hash, item, {distance: child}]
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, item):
+        self.size += 1
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            dist = hamming(value, current[0])
+            if dist not in current[2]:
+                current[2][dist] = node
+                return
+            current = current[2][dist]
+
+    def search(self, value, max_dist):
+        """
+        Gives back [(distance, item)] of all entries within max_dist,
+        closest first.
+        """
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            dist = hamming(value, node[0])
+            if dist <= max_dist:
+                found.append((dist, node[1]))
+            for child_dist, child in node[2].items():
+                if dist - max_dist <= child_dist <= dist + max_dist:
+                    stack.append(child)
+        found.sort()
+        return found
+
+
+class ImageMatcher:
+    """
+    Finds images by their content (perceptual hash) instead of their name.
+    Hashing needs numpy and Pillow, it runs in a process pool with jobs > 1
+    and the hashes are kept in the ParseCache (per file mtime).
+    The pool stays open and the new hashes are committed on close(), so
+    matching batch by batch costs no new pool and commit per batch; the
+    matcher can be used again after close.
+    """
+    def __init__(self, max_distance=6, jobs=1, parse_cache=None):
+        try:
+            import numpy
+            import PIL
+        except ImportError as e:
+            raise ImportError(f"Image matching needs numpy and Pillow: {e}")
+        self.max_distance = max_distance
+        self.jobs = jobs
+        self.parse_cache = parse_cache
+        self.trees = {}
+        self.errors = []
+        self.pool = None
+
+    def get_pool(self):
+        if self.jobs is None or self.jobs <= 1:
+            return None
+        if self.pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+        return self.pool
+
+    def close(self):
+        """
+        Shuts the pool down and commits the new hashes
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        if self.parse_cache is not None:
+            self.parse_cache.commit()
+
+    def hashes(self, paths):
+        """
+        Gives back {path: hash} (files which can not be read are left out)
+        """
+        paths = list(paths)
+        if self.parse_cache is None:
+            results = run_jobs(image_hash, paths, self.jobs, self.get_pool())
+        else:
+            results = self.parse_cache.parse("image_hash", image_hash, paths, self.jobs,
+                                             pool=self.get_pool(), commit=False)
+        hashes = {}
+        for path, (value, error) in zip(paths, results):
+            if error is not None:
+                logging.info(f"Error: could not hash {path}! {error}\n")
+                self.errors.append((path, error))
+                continue
+            hashes[path] = value
+        return hashes
+
+    def get_tree(self, key, paths):
+        """
+        BK-tree over the images in paths (a list or a function which gives
+        it, only called if the tree is not there), built once per key
+        """
+        if key not in self.trees:
+            if callable(paths):
+                paths = paths()
+            tree = BKTree()
+            for path, value in self.hashes(sorted(paths)).items():
+                tree.add(value, path)
+            self.trees[key] = tree
+        return self.trees[key]
+
+    def match(self, paths, key, candidates):
+        """
+        Gives back {path: closest candidate} for all paths which have an
+        image among the candidates within max_distance (candidates as
+        for get_tree)
+        """
+        tree = self.get_tree(key, candidates)
+        found = {}
+        for path, value in self.hashes(paths).items():
+            near = tree.search(value, self.max_distance)
+            if len(near) > 0:
+                found[path] = near[0][1]
+        return found
+
+
+DDS_MAGIC = b'DDS '
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_END = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+# DDS magic + header + DX10 header
+IMAGE_HEADER_SIZE = 148
+# end of a PNG file searched for the IEND chunk (editors may append data)
+PNG_TAIL_SIZE = 4096
+DDSD_MIPMAPCOUNT = 0x20000
+DDPF_FOURCC = 0x4
+DDSCAPS2_CUBEMAP = 0x200
+DDSCAPS2_VOLUME = 0x200000
+# bytes per 4x4 block of the compressed DDS formats
+DDS_BLOCK_SIZES = {'DXT1': 8, 'ATI1': 8, 'BC4U': 8, 'BC4S': 8,
+                   'DXT2': 16, 'DXT3': 16, 'DXT4': 16, 'DXT5': 16,
+                   'ATI2': 16, 'BC5U': 16, 'BC5S': 16}
+# DXGI format of the DX10 header -> bytes per block (compressed) or per pixel
+DXGI_BLOCK_SIZES = {**dict.fromkeys(range(70, 73), 8), **dict.fromkeys(range(73, 79), 16),
+                    **dict.fromkeys(range(79, 82), 8), **dict.fromkeys(range(82, 85), 16),
+                    **dict.fromkeys(range(94, 100), 16)}
+DXGI_PIXEL_SIZES = {**dict.fromkeys(range(27, 33), 4), **dict.fromkeys(range(87, 94), 4)}
+PNG_COLOR_TYPES = {0: 'gray', 2: 'rgb', 3: 'palette', 4: 'gray_alpha', 6: 'rgba'}
+# size key of the character files -> (width, height) of the portraits
+SIZE_CLASSES = {'large': (156, 210), 'small': (65, 67)}
+
+# Header of an image: format (dds/png), size, pixel format (like DXT5 or
+# rgba8) and the error if the file is broken (None if it is fine)
+ImageHeader = namedtuple('ImageHeader', ['format', 'width', 'height', 'pixel_format', 'error'])
+
+
+def dds_data_size(width, height, mipmaps, block_size=None, pixel_size=None):
+    """
+    Bytes of the image data of a DDS file with all mipmaps
+    """
+    total = 0
+    for level in range(mipmaps):
+        w = max(1, width >> level)
+        h = max(1, height >> level)
+        if block_size is not None:
+            total += max(1, (w + 3) // 4) * max(1, (h + 3) // 4) * block_size
+        else:
+            total += w * h * pixel_size
+    return total
+
+
+def dds_header(head, size):
+    if len(head) < 128:
+        return ImageHeader('dds', None, None, None, 'header cut off')
+    flags, height, width = struct.unpack_from('<3I', head, 8)
+    mipmaps = struct.unpack_from('<I', head, 28)[0]
+    pf_flags, fourcc, bits = struct.unpack_from('<I4sI', head, 80)
+    caps2 = struct.unpack_from('<I', head, 112)[0]
+    if width == 0 or height == 0:
+        return ImageHeader('dds', width, height, None, 'no image size')
+
+    header_size = 128
+    block_size = pixel_size = None
+    if pf_flags & DDPF_FOURCC:
+        pixel_format = fourcc.rstrip(b'\0').decode('ascii', 'replace')
+        block_size = DDS_BLOCK_SIZES.get(pixel_format)
+        if pixel_format == 'DX10':
+            if len(head) < 148:
+                return ImageHeader('dds', width, height, pixel_format, 'header cut off')
+            dxgi = struct.unpack_from('<I', head, 128)[0]
+            pixel_format = f"DXGI{dxgi}"
+            header_size = 148
+            block_size = DXGI_BLOCK_SIZES.get(dxgi)
+            pixel_size = DXGI_PIXEL_SIZES.get(dxgi)
+    else:
+        pixel_format = f"{bits}bit"
+        if bits % 8 == 0 and bits > 0:
+            pixel_size = bits // 8
+
+    levels = mipmaps if flags & DDSD_MIPMAPCOUNT and mipmaps > 0 else 1
+    # sizes of unknown formats, cube maps and volumes are not checked
+    if (block_size is None and pixel_size is None) or caps2 & (DDSCAPS2_CUBEMAP | DDSCAPS2_VOLUME):
+        return ImageHeader('dds', width, height, pixel_format, None)
+    expected = header_size + dds_data_size(width, height, levels, block_size, pixel_size)
+    if size < expected:
+        return ImageHeader('dds', width, height, pixel_format,
+                           f'cut off ({size} of {expected} bytes)')
+    return ImageHeader('dds', width, height, pixel_format, None)
+
+
+def png_header(head, tail):
+    if head[8:16] != b'\x00\x00\x00\x0dIHDR' or len(head) < 33:
+        return ImageHeader('png', None, None, None, 'IHDR missing')
+    width, height, depth, color = struct.unpack_from('>IIBB', head, 16)
+    pixel_format = f"{PNG_COLOR_TYPES.get(color, color)}{depth}"
+    if struct.unpack_from('>I', head, 29)[0] != zlib.crc32(head[12:29]):
+        return ImageHeader('png', width, height, pixel_format, 'IHDR broken')
+    if width == 0 or height == 0:
+        return ImageHeader('png', width, height, pixel_format, 'no image size')
+    if PNG_END not in tail:
+        return ImageHeader('png', width, height, pixel_format, 'cut off (IEND missing)')
+    return ImageHeader('png', width, height, pixel_format, None)
+
+
+def image_header(path):
+    """
+    Reads only the header (and for PNG the last PNG_TAIL_SIZE bytes) of a
+    DDS or PNG file, no image data is decoded. DDS files are checked
+    against the size their header needs, PNG files for the IHDR checksum
+    and the end chunk (data after it is allowed). Gives back an ImageHeader.
+    """
+    with open(path, 'rb') as filep:
+        head = filep.read(IMAGE_HEADER_SIZE)
+        size = os.fstat(filep.fileno()).st_size
+        tail = b''
+        # signature, IHDR chunk and IEND chunk are the smallest possible PNG
+        start = len(PNG_SIGNATURE) + 25
+        if head.startswith(PNG_SIGNATURE) and size >= start + len(PNG_END):
+            start = max(start, size - PNG_TAIL_SIZE)
+            filep.seek(start)
+            tail = filep.read(size - start)
+    # the format is taken from the content, mods have DDS files named .png too
+    if head.startswith(DDS_MAGIC):
+        return dds_header(head, size)
+    if head.startswith(PNG_SIGNATURE):
+        return png_header(head, tail)
+    return ImageHeader(None, None, None, None, 'no DDS or PNG file')
+
+
+def size_class(width, height):
+    """
+    Size class (see SIZE_CLASSES) which is closest to the image size
+    """
+    def distance(key):
+        ratio = width * height / (SIZE_CLASSES[key][0] * SIZE_CLASSES[key][1])
+        return max(ratio, 1 / ratio)
+    return min(SIZE_CLASSES, key=distance)
+
+
+def expected_size_class(path, size=None):
+    """
+    Size class a portrait should have: the size key of the character
+    file if known, small for ideas and files called small, large for
+    leaders (None if it can not be told)
+    """
+    if size in SIZE_CLASSES:
+        return size
+    if join("gfx", "interface", "ideas") in path or 'small' in split(path)[1].lower():
+        return 'small'
+    if 'leaders' in path:
+        return 'large'
+    return None
+
+
+class ImageValidator:
+    """
+    Checks the candidates of a look up by their image header (see
+    image_header) before one is taken: broken files are skipped and files
+    of the expected size class (small or large) are preferred.
+    The headers are kept per file and read again if size or mtime changed.
+    """
+    def __init__(self, max_candidates=20, metrics=None):
+        self.max_candidates = max_candidates
+        self.metrics = metrics
+        # path -> (mtime, size, ImageHeader)
+        self.headers = {}
+        # path -> error of the broken files
+        self.errors = {}
+
+    def header(self, path):
+        start = perf_counter()
+        try:
+            info = stat(path)
+        except OSError as e:
+            return ImageHeader(None, None, None, None, str(e))
+        cached = self.headers.get(path)
+        if cached is not None and cached[0] == info.st_mtime_ns and cached[1] == info.st_size:
+            return cached[2]
+        try:
+            header = image_header(path)
+        except OSError as e:
+            header = ImageHeader(None, None, None, None, str(e))
+        self.headers[path] = (info.st_mtime_ns, info.st_size, header)
+        if header.error is not None:
+            logging.info(f"Error: {path} is broken! {header.error}\n")
+            self.errors[path] = header.error
+        else:
+            self.errors.pop(path, None)
+        if self.metrics is not None:
+            self.metrics.add('validate', perf_counter() - start, files=1,
+                             size=min(info.st_size, IMAGE_HEADER_SIZE))
+        return header
+
+    @staticmethod
+    def rank(header, expected=None):
+        """
+        0 for a fitting image, 1 for another size class, None if broken
+        """
+        if header.error is not None:
+            return None
+        if expected is None or size_class(header.width, header.height) == expected:
+            return 0
+        return 1
+
+    def choose(self, index, candidates, expected=None):
+        """
+        Takes the first fitting of the candidates (entries of the ModIndex,
+        best first), else the first one which is not broken
+        """
+        best = None
+        for idx in islice(candidates, self.max_candidates):
+            rank = self.rank(self.header(join(*index.location(idx))), expected)
+            if rank == 0:
+                return idx
+            if rank is not None and best is None:
+                best = idx
+        return best
+
+
+class CrawlerConfig:
+    """
+    Settings shared by the parsers and crawlers: where the mods are
+    (the workshop folder, by default the current folder), the caches and
+    the number of processes/threads (concurrency is the number of threads
+    of the async crawl). The caches are opened on first use and shared by
+    everything created with the same config, close() (or a with block)
+    closes them. Parsers and crawlers created without a config use no
+    cache, so they write no files besides their reports.
+    """
+    def __init__(self, hoi4_path=None, cache_file=INDEX_CACHE_FILE,
+                 use_cache=True, jobs=1, copy_jobs=4, link='copy',
+                 concurrency=4):
+        if hoi4_path is None:
+            hoi4_path = getcwd()
+        self.hoi4_path = hoi4_path
+        self.cache_file = join(hoi4_path, cache_file)
+        self.use_cache = use_cache
+        self.jobs = jobs
+        self.copy_jobs = copy_jobs
+        self.link = link
+        self.concurrency = concurrency
+        self.metrics = Metrics()
+        self.paths = PathTable(hoi4_path)
+        self.index_cache = None
+        self.parse_cache = None
+
+    @classmethod
+    def from_arguments(cls, arguments, hoi4_path=None):
+        concurrency = arguments.async_jobs
+        if concurrency is None:
+            concurrency = 4
+        return cls(hoi4_path=hoi4_path, use_cache=not arguments.no_cache,
+                   jobs=arguments.jobs, copy_jobs=arguments.copy_jobs,
+                   link=arguments.link, concurrency=concurrency)
+
+    def mod_path(self, mod_id):
+        return join(self.hoi4_path, str(mod_id))
+
+    def get_index_cache(self):
+        if self.use_cache and self.index_cache is None:
+            self.index_cache = IndexCache(self.cache_file)
+        return self.index_cache
+
+    def get_parse_cache(self):
+        if self.use_cache and self.parse_cache is None:
+            self.parse_cache = ParseCache(self.cache_file)
+        return self.parse_cache
+
+    def walk(self, mod_path, index_cache=None):
+        """
+        Walks a mod through the index cache (the given one or the own one
+        if used) and counts it in the metrics
+        """
+        if index_cache is None:
+            index_cache = self.get_index_cache()
+        walker = walk(mod_path) if index_cache is None else index_cache.walk(mod_path)
+        return self.metrics.timed_iter('walk', walker, count=lambda item: len(item[2]))
+
+    def get_manifest(self, run):
+        """
+        Manifest of the last run with the key run (None without cache)
+        """
+        if not self.use_cache:
+            return None
+        return RunManifest(self.cache_file, run)
+
+    def get_copy_plan(self):
+        return CopyPlan(jobs=self.copy_jobs, link=self.link, metrics=self.metrics)
+
+    def metrics_summary(self):
+        """
+        Metrics of everything created with this config (call before close)
+        """
+        caches = {}
+        for name, cache in [('index', self.index_cache), ('parse', self.parse_cache)]:
+            if cache is not None:
+                caches[name] = (cache.hits, cache.misses)
+        return self.metrics.summary(caches)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for cache in [self.index_cache, self.parse_cache]:
+            if cache is not None:
+                cache.close()
+        self.index_cache = None
+        self.parse_cache = None
+
+
+# One portrait found in a character file: file name, country tag,
+# size key (small/large) and the resolved path relative to the mod folder
+PortraitRecord = namedtuple('PortraitRecord', ['file', 'tag', 'size', 'path'])
+
+
 class PortraitParser:
-    def __init__(self, mod_id, file_type='.txt', pfile_type=".dds"):
+    PORTRAIT_KEYS = ["small", "large"]
+    # paths never contain quotes, so several keys on one line are found too
+    PORTRAIT_EXPR = re.compile('(' + '|'.join(PORTRAIT_KEYS) + r')\s*=\s*"([^"\n]*)"')
+
+    def __init__(self, mod_id, file_type='.txt', pfile_type=".dds", jobs=None,
+                 parse_cache=None, config=None):
+        if config is None:
+            config = CrawlerConfig(use_cache=False)
+        if jobs is None:
+            jobs = config.jobs
+        if parse_cache is None:
+            parse_cache = config.get_parse_cache()
+        self.config = config
         self.mod_id = mod_id
-        self.mod_path = join(hoi4_path, str(mod_id))
+        self.mod_path = config.mod_path(mod_id)
         self.character_path = join(self.mod_path,
                                    "common", "characters")
         self.idea_path = join("gfx", "interface", "ideas")
         self.file_type = file_type
         self.pfile_type = pfile_type
-
-    def set_expressions(self):
-        keys = ["small", "large"]
-        expr = [f'{var}(\s*)=(\s*)\"(.*)\"' for var in keys]
-        return expr
-
-    def parse_file_for_expression(self, filename, expr):
-        with open(filename, 'r', encoding='utf-8') as f:
-            content = f.read()
-        results = re.findall(expr, content)
-        results = [res[-1] for res in results]
-        return results
+        self.jobs = jobs
+        self.parse_cache = parse_cache
+        # (file, error message) of character files which could not be parsed
+        self.errors = []
 
     def remove_suffix(self, fname):
         return fname[:-len(self.file_type)]
 
-    def replace_path(self, path, tag):
+    def replace_path(self, path, tag, pfile_type=None):
+        if pfile_type is None:
+            pfile_type = self.pfile_type
+
         if path.startswith("GFX_idea"):
             path = path.replace("GFX_", self.idea_path)
-            path += self.pfile_type
+            path += pfile_type
             return path
 
         if path.startswith("GFX_"):
             rep = join("gfx", "leaders", tag) + sep
             path = path.replace("GFX_", rep)
-            path += self.pfile_type
+            path += pfile_type
             return path
 
         return path
@@ -134,38 +1956,91 @@ class PortraitParser:
         paths = [self.replace_path(path, tag) for path in paths]
         return paths
 
-    def _portrait_list(self, expr):
-        portraits = []
+    def character_files(self):
         try:
-            files = list(walk(self.character_path))[0][2]
+            return list(walk(self.character_path))[0][2]
         except:
             logging.info("Character folder is missing.")
             return []
-        for file in files:
-            full_path = join(self.character_path, file)
-            paths = self.parse_file_for_expression(full_path, expr)
-            paths = self.replace_paths(paths, file)
-            portraits += paths
 
-        return portraits
+    @staticmethod
+    def parse_file(filename):
+        """
+        Reads a character file once and gives back (size, path) for
+        every portrait in it.
+        """
+        with open(filename, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return PortraitParser.PORTRAIT_EXPR.findall(content)
+
+    def iter_portraits(self):
+        """
+        Generator over the portraits of all character files of the mod
+        (as PortraitRecord) with the path resolved for pfile_type.
+        """
+        for record in self.iter_raw_portraits():
+            yield record._replace(path=self.replace_path(record.path, record.tag))
+
+    def iter_raw_portraits(self):
+        """
+        Generator over the portraits of all character files of the mod
+        (as PortraitRecord) with the path as written in the file.
+        Every file is read exactly once, with jobs > 1 the files are parsed
+        in parallel. With a ParseCache only changed files are read at all.
+        """
+        self.errors = []
+        files = self.character_files()
+        full_paths = [join(self.character_path, file) for file in files]
+        if self.parse_cache is None:
+            results = run_jobs(self.parse_file, full_paths, self.jobs)
+        else:
+            results = self.parse_cache.parse("characters", self.parse_file,
+                                             full_paths, self.jobs)
+        results = self.config.metrics.timed_iter('parse', results)
+        for file, (portraits, error) in zip(files, results):
+            if error is not None:
+                logging.info(f"Error: {file} not parsable! {error}\n")
+                self.errors.append((file, error))
+                continue
+            tag = self.remove_suffix(file)
+            for size, path in portraits:
+                yield PortraitRecord(file, tag, size, path)
 
     def portrait_list(self):
-        result = []
-        for expr in self.set_expressions():
-            portraits = self._portrait_list(expr)
-            portraits = [join(hoi4_path, str(self.mod_id), p) for p in portraits]
-            result += portraits
-        return result
+        return [join(self.mod_path, record.path)
+                for record in self.iter_portraits()]
 
 class ModCrawler:
     def __init__(self, mod_id, anime_mod_id,
                  missing_list_file="missing_items.txt",
                  parsed_out_file='parsed_list.txt',
                  diff_file="files_to_add.txt",
-                 file_type='.dds',out_folder="diff"):
+                 file_type='.dds',out_folder="diff", index_cache=None,
+                 jobs=None, parse_cache=None, copy_plan=None, image_matcher=None,
+                 config=None, delta_file="changed_list.txt", validator=None):
         """
         Set paths for mod and anime mod.
+        The mod folders are walked through the IndexCache, with the
+        ParseCache unchanged files are not parsed again.
+        jobs is the number of processes used for parsing. The found files
+        are collected in the CopyPlan and copied at the end of each step.
+        With an ImageMatcher portraits which the anime mod has under
+        another name are found by their image.
+        With an ImageValidator broken images are never taken and images
+        of the right size (small/large) are preferred.
+        With the cache a RunManifest is kept and the changes to the last
+        run are written to delta_file.
+        Everything not given is taken from the CrawlerConfig.
         """
+        if config is None:
+            config = CrawlerConfig(use_cache=False)
+        if jobs is None:
+            jobs = config.jobs
+        if index_cache is None:
+            index_cache = config.get_index_cache()
+        if parse_cache is None:
+            parse_cache = config.get_parse_cache()
+        self.config = config
         self.mod_id = mod_id
         self.anime_mod_id = anime_mod_id
         self.file_type = file_type
@@ -173,8 +2048,36 @@ class ModCrawler:
         self.missing = open(missing_list_file, 'w', encoding='utf-8')
         self.parsed_out_file = parsed_out_file
         self.diff_file = diff_file
+        self.delta_file = delta_file
+        self.jobs = jobs
+        self.parse_cache = parse_cache
         self.portrait_parser = PortraitParser(mod_id,
-                                              pfile_type=file_type)
+                                              pfile_type=file_type,
+                                              jobs=jobs,
+                                              parse_cache=parse_cache,
+                                              config=config)
+        if copy_plan is None:
+            copy_plan = config.get_copy_plan()
+        self.copy_plan = copy_plan
+        self.image_matcher = image_matcher
+        self.validator = validator
+        # path relative to the mod -> size key of the character file
+        # (only kept with a validator)
+        self.size_keys = {}
+        # path in the anime mod -> image of the anime mod with the same content
+        self.covered = {}
+        self.indexes = {}
+        self.snapshots = {}
+        # mod id -> lock, so a mod is only scanned once when scanned from threads
+        self.scan_locks = {}
+        # (mod id, file type) -> files changed since the last run (see prepare_manifest)
+        self.index_changes = {}
+        self.index_cache = index_cache
+        # (file, error message) of files which could not be parsed
+        self.errors = []
+
+    def walk(self, mod_path):
+        return self.config.walk(mod_path, self.index_cache)
 
     def __del__(self):
         """
@@ -182,14 +2085,60 @@ class ModCrawler:
         """
         self.missing.close()
 
-    def crawl(self, anime_mod_id_to_crawl=None, suff='', write=True, criteria=same_name):
+    def crawl(self, anime_mod_id_to_crawl=None, suff='', write=True, criteria=same_name,
+              tree=None):
+        """
+        Looks for every file of the main mod if it is in the anime mod.
+        tree is the listing of the main mod (as given by walk) if it is
+        already there.
+        """
         if anime_mod_id_to_crawl is None:
             anime_mod_id_to_crawl = self.anime_mod_id
-        org_mod_path = join(hoi4_path, str(self.mod_id))
-        for root, folders, files in walk(org_mod_path):
+        if tree is None:
+            tree = self.walk(self.config.mod_path(self.mod_id))
+        for root, folders, files in tree:
             for file in files:
                 self.find_replacement(root, file, anime_mod_id_to_crawl,
                                       suff=suff, write=write,criteria=criteria)
+        self.copy_plan.run()
+
+    def get_executor(self, concurrency=None):
+        """
+        Thread pool for the async crawl (concurrency threads, by default
+        taken from the config)
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        if concurrency is None:
+            concurrency = self.config.concurrency
+        return ThreadPoolExecutor(max_workers=max(1, concurrency))
+
+    def prepare_calls(self, anime_mod_ids, file_types, anime_mod_id):
+        """
+        Calls which scan the anime mod and index the mods to crawl (one
+        per mod), so they can be done at the same time before matching
+        """
+        crawled = [str(mid) for mid in anime_mod_ids]
+        return [partial(self.scan_mod, mid, snapshot=mid == str(anime_mod_id),
+                        file_types=file_types if mid in crawled else ())
+                for mid in dict.fromkeys([str(anime_mod_id)] + crawled)]
+
+    async def crawl_async(self, anime_mod_id_to_crawl=None, suff='', write=True,
+                          criteria=same_name, concurrency=None):
+        """
+        Same as crawl, but the main mod is walked while the anime mod is
+        scanned and indexed
+        """
+        if anime_mod_id_to_crawl is None:
+            anime_mod_id_to_crawl = self.anime_mod_id
+        with self.get_executor(concurrency) as executor:
+            org_mod_path = self.config.mod_path(self.mod_id)
+            calls = [partial(list, self.walk(org_mod_path))]
+            calls += self.prepare_calls([anime_mod_id_to_crawl], [self.file_type],
+                                        anime_mod_id_to_crawl)
+            tree, *_ = await run_in_threads(executor, calls)
+            await run_in_threads(executor, [partial(self.crawl, anime_mod_id_to_crawl,
+                                                    suff=suff, write=write,
+                                                    criteria=criteria, tree=tree)])
 
     def find_replacement(self, root, file, anime_mod_id_to_crawl,
                          criteria=same_name, suff='', write=True, copy=True):
@@ -201,7 +2150,7 @@ class ModCrawler:
                 # Write to file
                 if write is True:
                     self.missing.write(
-                        join(root.replace(hoi4_path, ""), file)+'\n')
+                        join(strip_prefix(root, self.config.hoi4_path), file)+'\n')
                 # copy file
                 if copy is True:
                     self.copy_file(file, root2, file2, suff, anime_mod_id_to_crawl)
@@ -215,139 +2164,517 @@ class ModCrawler:
         """
         if anime_mod_id is None:
             anime_mod_id = self.anime_mod_id
-            
-        aroot = root.replace(str(self.mod_id), str(anime_mod_id))
-        afpath = join(aroot, file)
-        if isfile(afpath):
-            return True
-        return False
 
-    def remove_suffix(self, fname):
-        return fname[:-len(self.file_type)]
+        org_mod_path = self.config.mod_path(self.mod_id)
+        if root == org_mod_path or root.startswith(org_mod_path + sep):
+            snapshot = self.get_snapshot(anime_mod_id)
+            start = perf_counter()
+            found = join(root[len(org_mod_path) + 1:], file) in snapshot
+            self.config.metrics.add('exists', perf_counter() - start, files=1)
+            return found
+
+        start = perf_counter()
+        aroot = self.config.paths.swap_mod(root, anime_mod_id, self.mod_id)
+        found = isfile(join(aroot, file))
+        self.config.metrics.add('exists', perf_counter() - start, files=1)
+        return found
+
+    def remove_suffix(self, fname, file_type=None):
+        if file_type is None:
+            file_type = self.file_type
+        return fname[:-len(file_type)]
     
-    def find_alternative(self, root1, file1, criteria, anime_mod_id=None):
+    def scan_mod(self, mod_id, snapshot=True, file_types=()):
+        """
+        Builds what is not there yet of the snapshot and the indexes of a
+        mod with one walk. If any index is needed, the indexes of all
+        file types (FILE_TYPES and the crawler's) are built together.
+        """
+        mod_id = str(mod_id)
+        if len(file_types) > 0:
+            file_types = dict.fromkeys(list(file_types) + [self.file_type] + FILE_TYPES)
+        with self.scan_locks.setdefault(mod_id, Lock()):
+            file_types = [file_type for file_type in file_types
+                          if (mod_id, file_type) not in self.indexes]
+            snapshot = snapshot and mod_id not in self.snapshots
+            if not snapshot and len(file_types) == 0:
+                return
+            found, indexes = scan_mod(self.config.mod_path(mod_id), file_types,
+                                      snapshot=snapshot, walker=self.walk,
+                                      paths=self.config.paths)
+            if found is not None:
+                self.snapshots[mod_id] = found
+            for file_type, index in indexes.items():
+                self.indexes[(mod_id, file_type)] = index
+
+    def get_index(self, mod_id, file_type=None):
+        """
+        Gives the file index of a mod. It is built once per mod id
+        and file type (the anime mod is listed at the same time, see
+        scan_mod).
+        """
+        if file_type is None:
+            file_type = self.file_type
+        key = (str(mod_id), file_type)
+        if key not in self.indexes:
+            self.scan_mod(mod_id, snapshot=str(mod_id) == str(self.anime_mod_id),
+                          file_types=[file_type])
+        return self.indexes[key]
+
+    def forget(self, mod_ids):
+        """
+        Drops the indexes and file lists of the given mods (e.g. after a
+        workshop update), they are built again when they are used.
+        Gives back the dropped indexes.
+        """
+        mod_ids = {str(mod_id) for mod_id in mod_ids}
+        dropped = [index for key, index in self.indexes.items() if key[0] in mod_ids]
+        self.indexes = {key: index for key, index in self.indexes.items()
+                        if key[0] not in mod_ids}
+        self.snapshots = {key: snapshot for key, snapshot in self.snapshots.items()
+                          if key not in mod_ids}
+        if self.image_matcher is not None:
+            self.image_matcher.trees = {key: tree for key, tree in self.image_matcher.trees.items()
+                                        if key[0] not in mod_ids}
+        return dropped
+
+    def get_snapshot(self, mod_id):
+        """
+        Gives the set of files of a mod. It is listed once per mod id
+        (and indexed at the same time unless it is the main mod).
+        """
+        mod_id = str(mod_id)
+        if mod_id not in self.snapshots:
+            file_types = [] if mod_id == str(self.mod_id) else [self.file_type]
+            self.scan_mod(mod_id, file_types=file_types)
+        return self.snapshots[mod_id]
+
+    def find_alternative(self, root1, file1, criteria, anime_mod_id=None,
+                         file_type=None, size=None):
         """
         searches for a suitable replacement in a mod for a certain criteria.
         A criteria is a function which compares the two files and return True
         if it is fit.
+        With a validator the candidates are checked by their image header,
+        size is the size key (small/large) of the portrait if known.
         """
         if anime_mod_id is None:
             anime_mod_id = self.anime_mod_id
 
-        rfile1 = self.remove_suffix(file1)
-        anime_mod_path = join(hoi4_path, str(anime_mod_id))
-        
-        for root2, folders2, files2 in walk(anime_mod_path):
-            for file2 in files2:
-                if not file2.endswith(self.file_type):
-                    continue
-                rfile2 = self.remove_suffix(file2)
-                if criteria(rfile1, rfile2, root1, root2) is True:
-                    logging.info(f"Found {root2}{file2} as alternative to {root2}{file1}\n")
-                    return root2, file2
+        rfile1 = self.remove_suffix(file1, file_type)
+        index = self.get_index(anime_mod_id, file_type)
+        start = perf_counter()
+        if self.validator is None:
+            idx = index.find(rfile1, criteria, root1)
+        else:
+            expected = expected_size_class(join(root1 or '', file1), size)
+            idx = self.validator.choose(index, index.find_all(rfile1, criteria, root1),
+                                        expected)
+        self.config.metrics.add('match', perf_counter() - start, files=1)
+        if idx is None:
+            return None, None
 
-        return None, None
+        root2, file2 = index.location(idx)
+        logging.debug("Found %s%s as alternative to %s%s", root2, file2, root2, file1)
+        return root2, file2
                 
     def copy_file(self, org_file, found_root, found_file, suff, anime_mod_id_to_crawl,
-                  temp_root=None, anime_mod_id=None,org_root=None):
+                  temp_root=None, anime_mod_id=None,org_root=None, file_type=None):
         """
-        Copies file (currently to copy folder)
+        Plans to copy file (currently to copy folder),
+        the copying itself is done by copy_plan.run().
+        Gives back the destination the file is written to (None if the
+        names are taken by other files).
         """
         if anime_mod_id is None:
             anime_mod_id = self.anime_mod_id
+        if file_type is None:
+            file_type = self.file_type
 
+        paths = self.config.paths
+        out_mod = self.out_folder + str(anime_mod_id)
         if temp_root is None and org_root is not None:
-            temp_root = org_root.replace(str(anime_mod_id_to_crawl),
-                                           self.out_folder + str(anime_mod_id))
+            # org_root is inside the anime mod the files are added to
+            temp_root = paths.swap_mod(org_root, out_mod, anime_mod_id)
         elif temp_root is None and org_root is None:
-            temp_root = found_root.replace(str(anime_mod_id_to_crawl),
-                                           self.out_folder + str(anime_mod_id))
-
-        logging.info(f"Copied {found_root}{found_file} to {temp_root}{org_file}\n")
-        new_file = join(temp_root,org_file)
-        new_path = os.path.split(new_file)[0]
-        makedirs(new_path, exist_ok=True)
-        if isfile(join(temp_root, org_file)):
-            org_file2 = org_file.replace(self.file_type, suff+self.file_type)
-        else:
-            org_file2 = org_file
-        file_copy(join(found_root, found_file), join(temp_root, org_file2))
+            temp_root = paths.swap_mod(found_root, out_mod, anime_mod_id_to_crawl)
+
+        logging.debug("Copy %s%s to %s%s", found_root, found_file, temp_root, org_file)
+        org_file2 = org_file
+        if org_file.endswith(file_type):
+            org_file2 = org_file[:-len(file_type)] + suff + file_type
+        return self.copy_plan.add(join(found_root, found_file), join(temp_root, org_file),
+                                  join(temp_root, org_file2))
 
     def filter_missing_files(self, anime_mod_id):
-        org_mod_id = self.portrait_parser.mod_id
-        file_list = self.portrait_parser.portrait_list()
-        file_list = [file.replace(str(org_mod_id), str(anime_mod_id))
-                                  for file in file_list]
-        filtered_list = [file for file in file_list if not isfile(file)]
-        # remove duplicates:
-        filtered_list = list(set(filtered_list))
-        return filtered_list
+        """
+        Gives back the portraits of the main mod which are not in the
+        anime mod (as paths inside the anime mod, without duplicates)
+        """
+        return [file_path for _, file_path in self.iter_missing_files(anime_mod_id)]
+
+    def discover_portraits(self, file_types=None, records=None):
+        """
+        Pipeline stage: gives (file_type, path relative to the mod) of all
+        portraits of the main mod while the character files are read
+        (or of the given PortraitRecords).
+        Paths which end with another of the file types are only given for
+        their own type.
+        """
+        if file_types is None:
+            file_types = [self.file_type]
+        if records is None:
+            records = self.portrait_parser.iter_raw_portraits()
+        for record in records:
+            for file_type in file_types:
+                path = self.portrait_parser.replace_path(record.path, record.tag, file_type)
+                other_types = tuple(ft for ft in file_types if ft != file_type)
+                if len(other_types) > 0 and path.endswith(other_types):
+                    continue
+                if self.validator is not None:
+                    self.size_keys[normpath(path)] = record.size
+                yield file_type, path
+
+    def iter_missing_files(self, anime_mod_id, file_types=None, records=None):
+        """
+        Pipeline stage: gives (file_type, path inside the anime mod) of the
+        portraits which are not in the anime mod (and not covered by an image,
+        see filter_covered_files), every path once.
+        """
+        snapshot = self.get_snapshot(anime_mod_id)
+        seen = set()
+        for batch in batched(self.discover_portraits(file_types, records), BATCH_SIZE):
+            start = perf_counter()
+            new = []
+            for file_type, path in batch:
+                path = normpath(path)
+                if path not in seen:
+                    seen.add(path)
+                    new.append((file_type, path))
+            not_there = snapshot.missing(path for _, path in new)
+            candidates = [(file_type, path) for file_type, path in new if path in not_there]
+            missing = set(self.filter_covered_files([path for _, path in candidates],
+                                                    anime_mod_id))
+            self.config.metrics.add('exists', perf_counter() - start, files=len(batch))
+            for file_type, path in candidates:
+                if path in missing:
+                    yield file_type, join(snapshot.mod_path, path)
+
+    def filter_covered_files(self, rel_paths, anime_mod_id):
+        """
+        Removes the portraits whose image the anime mod already has under
+        another name (only with an image_matcher). They are kept in
+        self.covered and copied by add_covered_portraits.
+        """
+        if self.image_matcher is None:
+            return rel_paths
+
+        snapshot = self.get_snapshot(anime_mod_id)
+        org_snapshot = self.get_snapshot(self.mod_id)
+        rel_paths = set(rel_paths)
+        by_type = {}
+        for path in rel_paths:
+            if path in org_snapshot:
+                by_type.setdefault(os.path.splitext(path)[1].lower(), []).append(path)
+
+        for ext, paths in by_type.items():
+            org_paths = {join(org_snapshot.mod_path, path): path for path in paths}
+            found = self.image_matcher.match(org_paths, (str(anime_mod_id), ext),
+                                             partial(snapshot.full_paths, ext))
+            for org_path, alt_path in found.items():
+                path = org_paths[org_path]
+                logging.debug("%s has the same image as %s", alt_path, org_path)
+                self.covered[join(snapshot.mod_path, path)] = alt_path
+                rel_paths.discard(path)
+        return rel_paths
+
+    def add_covered_portraits(self, anime_mod_id):
+        """
+        Copies the images found by filter_covered_files to the
+        expected names
+        """
+        for file_path, alt_path in self.covered.items():
+            root1, file1 = split(file_path)
+            root2, file2 = split(alt_path)
+            self.copy_file(file1, root2, file2, '', anime_mod_id,
+                           anime_mod_id=anime_mod_id, org_root=root1)
+        self.covered = {}
 
     def add_missing_portrait(self, file_path, anime_mod_id,
                               anime_mod_id_to_crawl,
-                              criteria=contains_name, suff=''):
+                              criteria=contains_name, suff='',
+                              file_type=None, write=True):
         root1, file1 = split(file_path)
-        self.missing.write(f"{root1}{file1}\n")
+        if write is True:
+            self.missing.write(f"{root1}{file1}\n")
         root2, file2 = self.find_alternative(root1, file1,
                                              criteria,
-                                             anime_mod_id=anime_mod_id_to_crawl)
+                                             anime_mod_id=anime_mod_id_to_crawl,
+                                             file_type=file_type)
         if root2 is not None:
             self.copy_file(file1, root2, file2, suff, anime_mod_id_to_crawl,
-                           anime_mod_id = anime_mod_id, org_root=root1)
+                           anime_mod_id = anime_mod_id, org_root=root1,
+                           file_type=file_type)
             return True
         return False
             
+    def match_missing_files(self, missing, anime_mod_id, anime_mod_ids_to_crawl,
+                            criteria=contains_name, suffixes=None, manifest=None):
+        """
+        Pipeline stage: looks every missing portrait up in the anime mods
+        (in the given order) and plans the copies. Gives (path, found) with
+        found True if any of the mods had a replacement.
+        With a RunManifest the matches of the last run are taken if the
+        anime mods did not change, and the matches and copies are recorded.
+        """
+        if suffixes is None:
+            suffixes = default_suffixes(len(anime_mod_ids_to_crawl))
+        prefix = self.config.mod_path(anime_mod_id) + sep
+        for file_type, file_path in missing:
+            root1, file1 = split(file_path)
+            self.missing.write(f"{root1}{file1}\n")
+            matches = None
+            if manifest is not None:
+                matches = manifest.previous_matches(
+                    file_path, file_type,
+                    valid=partial(self.match_is_current, criteria, anime_mod_ids_to_crawl))
+            if matches is None:
+                size = self.size_keys.get(strip_prefix(file_path, prefix))
+                matches = [self.find_alternative(root1, file1, criteria,
+                                                 anime_mod_id=mid, file_type=file_type,
+                                                 size=size)
+                           for mid in anime_mod_ids_to_crawl]
+
+            copied = False
+            for mid, suff, (root2, file2) in zip(anime_mod_ids_to_crawl, suffixes, matches):
+                if root2 is None:
+                    continue
+                dst = self.copy_file(file1, root2, file2, suff, mid,
+                                     anime_mod_id=anime_mod_id, org_root=root1,
+                                     file_type=file_type)
+                if manifest is not None and dst is not None:
+                    manifest.add_output(dst, join(root2, file2))
+                copied = True
+            if manifest is not None:
+                manifest.add_match(file_path, file_type, matches)
+            yield file_path, copied
+
+    def prepare_manifest(self, anime_mod_ids_to_crawl, file_types, criteria,
+                         anime_mod_id, suffixes):
+        """
+        Opens the manifest of the last run with the same settings and
+        records the current inputs: the character files and the files of
+        every crawled mod
+        """
+        run = json.dumps([str(self.mod_id), str(anime_mod_id),
+                          [str(mid) for mid in anime_mod_ids_to_crawl],
+                          file_types, criteria_key(criteria), suffixes,
+                          self.validator is not None])
+        manifest = self.config.get_manifest(run)
+        if manifest is None:
+            return None
+        parser = self.portrait_parser
+        for file in parser.character_files():
+            manifest.add_input(f"characters:{file}",
+                               file_key(join(parser.character_path, file)))
+        if hasattr(criteria, 'forget'):
+            criteria.forget(changes for changes in self.index_changes.values()
+                            if isinstance(changes, ModIndex))
+        self.index_changes = {}
+        for mid in anime_mod_ids_to_crawl:
+            for file_type in file_types:
+                index = self.get_index(mid, file_type)
+                changed = manifest.add_index(f"index:{mid}:{file_type}", index.files())
+                if changed is not None and len(changed) > 0:
+                    # only the changed files, to see which portraits they fit
+                    changed = ModIndex(index.mod_path, file_type,
+                                       walker=partial(list_walk, rel_paths=changed),
+                                       paths=self.config.paths)
+                self.index_changes[(str(mid), file_type)] = changed
+        return manifest
+
+    def match_is_current(self, criteria, anime_mod_ids_to_crawl, file_path, file_type):
+        """
+        True if none of the files added to or removed from the crawled
+        mods since the last run fits the portrait (see prepare_manifest)
+        """
+        root1, file1 = split(file_path)
+        stem = self.remove_suffix(file1, file_type)
+        for mid in anime_mod_ids_to_crawl:
+            changes = self.index_changes.get((str(mid), file_type))
+            if changes is None:
+                return False
+            if len(changes) > 0 and changes.find(stem, criteria, root1) is not None:
+                return False
+        return True
+
+    def write_delta(self, manifest):
+        """
+        Writes the changes to the last run to delta_file
+        """
+        delta = manifest.delta()
+        prefix = self.config.hoi4_path + sep
+        with open(self.delta_file, 'w', encoding='utf-8') as filep:
+            for key, paths in delta.items():
+                filep.write(f"\n{key}:\n")
+                filep.writelines(strip_prefix(path, prefix) + '\n' for path in paths)
+        logging.info(f"Changes to last run: {len(delta['added'])} portraits added, "
+                     f"{len(delta['removed'])} removed, {len(delta['changed'])} changed, "
+                     f"{manifest.reused} matches reused\n")
+        return delta
+
+    @staticmethod
+    def report_files(items, report):
+        """
+        Pipeline stage: writes the paths passing through to the report
+        """
+        for file_type, file_path in items:
+            report.write(file_path)
+            yield file_type, file_path
+
+    def crawl_pipeline(self, anime_mod_ids_to_crawl, file_types=None,
+                       criteria=contains_name, anime_mod_id=None, suffixes=None,
+                       records=None):
+        """
+        Streaming crawl: discover -> filter -> match -> copy -> report.
+        The stages are generators, so the portraits go through one by one,
+        the copy plan is written in batches while matching goes on and the
+        reports are written while the results come in.
+        records are the PortraitRecords of the main mod if already parsed.
+        With the cache the changes to the last run are written to
+        delta_file (see RunManifest).
+        """
+        if anime_mod_id is None:
+            anime_mod_id = self.anime_mod_id
+        if file_types is None:
+            file_types = [self.file_type]
+        if suffixes is None:
+            suffixes = default_suffixes(len(anime_mod_ids_to_crawl))
+        manifest = self.prepare_manifest(anime_mod_ids_to_crawl, file_types, criteria,
+                                         anime_mod_id, suffixes)
+
+        anime_mod_path = self.config.mod_path(anime_mod_id)
+        metrics = self.config.metrics
+        with ReportWriter(self.parsed_out_file, anime_mod_path, metrics) as parsed, \
+                ReportWriter(self.diff_file, anime_mod_path, metrics) as missed:
+            missing = self.iter_missing_files(anime_mod_id, file_types, records)
+            missing = self.report_files(missing, parsed)
+            matched = self.match_missing_files(missing, anime_mod_id,
+                                               anime_mod_ids_to_crawl,
+                                               criteria=criteria, suffixes=suffixes,
+                                               manifest=manifest)
+            for file_path, copied in matched:
+                if copied is False:
+                    missed.write(file_path)
+
+            self.add_covered_portraits(anime_mod_id)
+            if self.image_matcher is not None:
+                self.image_matcher.close()
+            self.copy_plan.run()
+            logging.info(f"{parsed.count} portraits missing, {missed.count} not found\n")
+
+        if manifest is not None:
+            self.write_delta(manifest)
+            manifest.save()
+            manifest.close()
+
     def add_missing_portraits(self, anime_mod_id_to_crawl,
                               criteria=contains_name, suff='',
                               anime_mod_id=None):
+        self.crawl_pipeline([anime_mod_id_to_crawl], criteria=criteria,
+                            anime_mod_id=anime_mod_id, suffixes=[suff])
+            
+    def add_missing_portraits_multi(self, anime_mod_ids_to_crawl,
+                                    file_types=None, criteria=contains_name,
+                                    anime_mod_id=None):
+        """
+        Crawls several anime mods for several file types in one pass.
+        The character files are parsed once and every missing portrait is
+        looked up in the anime mods in the given order. A file from the
+        k-th mod (k > 0) gets the suffix _v{k} if the name is already taken.
+        """
+        self.crawl_pipeline(anime_mod_ids_to_crawl, file_types=file_types,
+                            criteria=criteria, anime_mod_id=anime_mod_id)
+
+    async def add_missing_portraits_async(self, anime_mod_ids_to_crawl,
+                                          file_types=None, criteria=contains_name,
+                                          anime_mod_id=None, concurrency=None):
+        """
+        Same as add_missing_portraits_multi, but the character files are
+        parsed while the anime mod is scanned and the mods to crawl are
+        indexed, each in its own thread. The found files are copied by the
+        copy plan while matching goes on.
+        """
         if anime_mod_id is None:
             anime_mod_id = self.anime_mod_id
+        if file_types is None:
+            file_types = [self.file_type]
+        with self.get_executor(concurrency) as executor:
+            calls = [partial(list, self.portrait_parser.iter_raw_portraits())]
+            calls += self.prepare_calls(anime_mod_ids_to_crawl, file_types, anime_mod_id)
+            records, *_ = await run_in_threads(executor, calls)
+            await run_in_threads(executor, [partial(self.crawl_pipeline,
+                                                    anime_mod_ids_to_crawl,
+                                                    file_types=file_types,
+                                                    criteria=criteria,
+                                                    anime_mod_id=anime_mod_id,
+                                                    records=records)])
 
-        filtered_list = self.filter_missing_files(anime_mod_id)
+    def write_file_list(self, log_name, file_list, anime_mod_id):
+        with ReportWriter(log_name, self.config.mod_path(anime_mod_id),
+                          self.config.metrics) as report:
+            for fname in file_list:
+                report.write(fname)
 
-        self.write_file_list(self.parsed_out_file, filtered_list, anime_mod_id)
+    def package_sprites(self, package):
+        """
+        Gives (sprite name, texturefile) of the portraits of the character
+        files which are given by sprite name (GFX_...) and are in the package
+        """
+        file_types = list(dict.fromkeys([self.file_type] + FILE_TYPES))
+        parser = self.portrait_parser
+        for record in parser.iter_raw_portraits():
+            if not record.path.startswith("GFX_"):
+                continue
+            for file_type in file_types:
+                target = package.target(normpath(parser.replace_path(record.path, record.tag,
+                                                                     file_type)))
+                if target is not None:
+                    yield record.path, target
+                    break
 
-        missed_files = []
-        for file_path in filtered_list:
-            copied = self.add_missing_portrait(file_path, anime_mod_id,
-                                      anime_mod_id_to_crawl,
-                                      criteria=criteria, suff=suff)
-            if copied is False:
-                missed_files.append(file_path)
-        self.write_file_list(self.diff_file, missed_files, anime_mod_id)
-        
-            
-    @staticmethod
-    def write_file_list(log_name, file_list, anime_mod_id):
-        with open(log_name, 'w', encoding='utf-8') as filep:
-            added_nl = [fname.replace(join(hoi4_path,f'{anime_mod_id}')+sep,'') + '\n'
-                        for fname in file_list]
-            role_lists = {}
-            for role in ROLES:
-                role_lists[role] = [fname for fname in added_nl if '/'+role+'/' in fname]
-            misc = set(added_nl)
-            misc = misc.difference(*[val for val in role_lists.values()])
-            misc = list(misc)
-            role_lists[MISC_KEY] = misc
-            
-            for key, val in role_lists.items():
-                filep.write(f"\n{key}:\n")
-                filep.writelines(val)
+    def package_overrides(self, package):
+        """
+        Gives {character file: {path: path in the package}} of the portraits
+        given by path whose content is in the package under another path
+        """
+        overrides = {}
+        for record in self.portrait_parser.iter_raw_portraits():
+            if record.path.startswith("GFX_"):
+                continue
+            rel_path = normpath(record.path).replace(sep, '/')
+            target = package.target(rel_path)
+            if target is not None and target != rel_path:
+                overrides.setdefault(record.file, {})[record.path] = target
+        return overrides
+
+    def write_package(self, package):
+        """
+        Finishes a ModPackage used as copy plan: writes the sprite
+        definitions, the character files which have to point to other
+        files and the descriptor (depending on the main and anime mod)
+        """
+        sprites = package.write_sprites(self.package_sprites(package))
+        overrides = self.package_overrides(package)
+        for file, replacements in overrides.items():
+            package.write_override(join(self.portrait_parser.character_path, file),
+                                   f"common/characters/{file}", replacements)
+        main_name = mod_name(self.config.mod_path(self.mod_id))
+        anime_name = mod_name(self.config.mod_path(self.anime_mod_id))
+        package.close(f"{anime_name} portraits for {main_name}", [main_name, anime_name])
+        logging.info(f"{sprites} sprites, {len(overrides)} character files overridden\n")
         
             
-mod_id = arguments.mod_id[0]
-anime_mod_id = arguments.anime_mod_id[0]
-anime_mod_ids_to_crawl = [anime_mod_id]
-if len(arguments.anime_mod_id_to_crawl) > 0:
-    anime_mod_ids_to_crawl += arguments.anime_mod_id_to_crawl
-
-if mod_id in tag_list.keys():
-    mod_id = tag_list[mod_id]
-if anime_mod_id in tag_list.keys():
-    anime_mod_id = tag_list[anime_mod_id]
-anime_mod_ids_to_crawl = [tag_list[mid] if mid in tag_list.keys() else mid
-                          for mid in anime_mod_ids_to_crawl]
-
 ### New Parser version
 class ModCrawlerKR(ModCrawler):
     """
@@ -357,25 +2684,26 @@ class ModCrawlerKR(ModCrawler):
     TEXTUREFILE_KEY = "texturefile"
     NAME_KEY = 'name'
     
-    def get_portraits_from_gfx(self,fname,portrait_type="large"):
-        try:
-            obj = paradox2list(fname)
-        except:
-            msg = f"Error: {fname} not parsable!"
-            self.missing.write(msg)
-            print(msg)
-            
-            
+    @staticmethod
+    def read_portraits_from_gfx(fname, portrait_type="large"):
+        """
+        Gives back {name: texturefile} of all sprites in a .gfx file
+        whose name ends with portrait_type
+        """
+        # Hoi4Converter is only needed for KR, so it is imported on demand
+        from Hoi4Converter.converter import paradox2list
+        from Hoi4Converter.mappings import has_key
+        obj = paradox2list(fname)
         items = {}
         for portrait in obj[0][1]:
-            n, _ = has_key(portrait,self.NAME_KEY)
+            n, _ = has_key(portrait,ModCrawlerKR.NAME_KEY)
             name = n[0][1][0]
             if '"' in name:
                 name = name.replace('"','')
             if not name.endswith(portrait_type):
                 continue
             
-            t, _ = has_key(portrait,self.TEXTUREFILE_KEY)
+            t, _ = has_key(portrait,ModCrawlerKR.TEXTUREFILE_KEY)
             item = t[0][1][0]
             if '"' in item:
                 item = item.replace('"','')
@@ -383,18 +2711,42 @@ class ModCrawlerKR(ModCrawler):
             items[name] = item
             
         return items
-            
 
-    def parse_list(self):
+    def parse_error(self, fname, error):
+        msg = f"Error: {fname} not parsable! {error}"
+        self.errors.append((fname, error))
+        self.missing.write(msg + '\n')
+        print(msg)
+
+    def get_portraits_from_gfx(self,fname,portrait_type="large"):
+        result, error = _run_job(partial(self.read_portraits_from_gfx,
+                                         portrait_type=portrait_type), fname)
+        if error is not None:
+            self.parse_error(fname, error)
+            return {}
+        return result
+
+    def parse_list(self, portrait_type="large"):
         """
         Parses the .gfx files for portraits and registres them
         """
-        path = os.path.join(hoi4_path, str(KAISERREICH_ID),self.KR_PORTRAIT_FOLDER)
+        path = os.path.join(self.config.mod_path(KAISERREICH_ID),self.KR_PORTRAIT_FOLDER)
         files = os.listdir(path)
+        fnames = [os.path.join(path,fil) for fil in files]
+        read = partial(self.read_portraits_from_gfx, portrait_type=portrait_type)
+        if self.parse_cache is None:
+            results = run_jobs(read, fnames, self.jobs)
+        else:
+            results = self.parse_cache.parse(f"gfx:{portrait_type}", read,
+                                             fnames, self.jobs)
+        results = self.config.metrics.timed_iter('parse', results)
+        self.errors = []
         items = {}
-        for fil in files:
-            fname = os.path.join(path,fil)
-            items.update(self.get_portraits_from_gfx(fname))
+        for fname, (result, error) in zip(fnames, results):
+            if error is not None:
+                self.parse_error(fname, error)
+                continue
+            items.update(result)
         
         return items
     
@@ -406,47 +2758,790 @@ class ModCrawlerKR(ModCrawler):
         alts = {}
         for name, item in items.items():
             item_file = os.path.split(item)[1]
-            alt_path, alt = self.find_alternative(None, item_file, criteria)
+            # sprite names end with their size (see read_portraits_from_gfx)
+            size = next((key for key in SIZE_CLASSES if name.endswith(key)), None)
+            alt_path, alt = self.find_alternative(None, item_file, criteria, size=size)
             if alt is None:
                 not_found[item] = item
             else:
-                temp_root = os.path.join(hoi4_path, self.out_folder + str(self.anime_mod_id))
+                temp_root = self.config.mod_path(self.out_folder + str(self.anime_mod_id))
                 if write is True:
                     self.copy_file(item, alt_path, alt, suff, self.anime_mod_id,
                     temp_root=temp_root, anime_mod_id=None,org_root=None)
                 
                 alts[item] = os.path.join(alt_path,alt)
                 
+        self.copy_plan.run()
         return alts, not_found
     
     def crawl(self, anime_mod_id_to_crawl=None, suff='', write=True, criteria=contains_name):
-        items = crawler.parse_list()
-        alts, not_found = crawler.search_for_alternatives(items,suff=suff,write=write,criteria=criteria)
-        
+        items = self.parse_list()
+        alts, not_found = self.search_for_alternatives(items,suff=suff,write=write,criteria=criteria)
+        self.write_results(alts, not_found)
+
+    async def crawl_async(self, anime_mod_id_to_crawl=None, suff='', write=True,
+                          criteria=contains_name, concurrency=None):
+        """
+        Same as crawl, but the .gfx files are parsed while the anime mod
+        is indexed
+        """
+        with self.get_executor(concurrency) as executor:
+            calls = [self.parse_list, partial(self.get_index, self.anime_mod_id)]
+            items, _ = await run_in_threads(executor, calls)
+            [(alts, not_found)] = await run_in_threads(
+                executor, [partial(self.search_for_alternatives, items, suff=suff,
+                                   write=write, criteria=criteria)])
+        self.write_results(alts, not_found)
+
+    def package_sprites(self, package):
+        """
+        Gives (sprite name, texturefile) of the portraits of the .gfx files
+        which are in the package
+        """
+        for name, item in self.parse_list().items():
+            target = package.target(normpath(item))
+            if target is not None:
+                yield name, target
 
+    def package_overrides(self, package):
+        # KR gives all portraits by sprite name
+        return {}
+
+    def write_results(self, alts, not_found):
+        start = perf_counter()
         self.missing.write("Missing files:\n")
         self.missing.writelines([it + '\n' for it in not_found])
         
         with open(self.diff_file,'w',encoding='utf-8') as f:
             f.write("Files to copy:\n")
             for key, val in alts.items():
-                val = val.replace(join(hoi4_path,str(self.anime_mod_id))+os.sep,'')
+                val = strip_prefix(val, self.config.mod_path(self.anime_mod_id)+os.sep)
                 f.write(f"{val} -> {key}\n")
+        self.config.metrics.add('report', perf_counter() - start,
+                                files=len(alts) + len(not_found))
         
 
     def __del__(self):
         pass
 
-portrait_parser = PortraitParser(mod_id)
-crawler = ModCrawlerKR(mod_id,anime_mod_id,file_type='.png') if mod_id == KAISERREICH_ID else ModCrawler(mod_id, anime_mod_id)
+# inotify events (see inotify(7))
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+
+
+class InotifyWatcher:
+    """
+    Tells which folders below the given paths changed, with inotify
+    (Linux only). The folders above the paths (the workshop folder) are
+    watched too, so a mod folder which is created or replaced (moved
+    away and written again) is watched again.
+    Raises OSError if inotify is not there or the number of watches is
+    too small for the mods (also from changes, when new folders are added).
+    """
+    MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    PARENT_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+    def __init__(self, paths):
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> folder
+        self.folders = {}
+        # watch descriptor -> folder above the paths
+        self.parents = {}
+        self.roots = set(paths)
+        try:
+            for parent in sorted({split(path)[0] for path in self.roots}):
+                wd = self.watch(parent, self.PARENT_MASK)
+                if wd is not None:
+                    self.parents[wd] = parent
+            for path in self.roots:
+                self.add_tree(path)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def watch(self, folder, mask):
+        """
+        Watch descriptor for folder (None if the folder is gone already)
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+        if wd < 0:
+            errno = self.ctypes.get_errno()
+            if errno in (2, 20):  # ENOENT, ENOTDIR
+                return None
+            raise OSError(errno, f"Can not watch {folder}: {os.strerror(errno)}")
+        return wd
+
+    def add(self, folder):
+        wd = self.watch(folder, self.MASK)
+        if wd is not None:
+            self.folders[wd] = folder
+
+    def add_tree(self, path):
+        for root, folders, files in walk(path):
+            self.add(root)
+
+    def remove_tree(self, path):
+        """
+        Stops watching path and the folders below (after it was moved away,
+        the watches would follow it)
+        """
+        for wd, folder in list(self.folders.items()):
+            if folder == path or folder.startswith(path + sep):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.folders[wd]
+
+    def changes(self, timeout):
+        """
+        Waits up to timeout seconds and gives back the set of folders in
+        which something changed
+        """
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + 16 <= len(data):
+                wd, mask, _, length = struct.unpack_from('iIII', data, pos)
+                name = data[pos + 16:pos + 16 + length].rstrip(b'\0')
+                pos += 16 + length
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost, everything could have changed
+                    changed.update(self.folders.values())
+                    changed.update(self.roots)
+                    continue
+                if wd in self.parents:
+                    # only the mod folders themselves matter here
+                    folder = None
+                    path = join(self.parents[wd], os.fsdecode(name))
+                    if path not in self.roots:
+                        continue
+                else:
+                    folder = self.folders.get(wd)
+                    if folder is None:
+                        continue
+                    changed.add(folder)
+                    path = join(folder, os.fsdecode(name))
+                if mask & IN_IGNORED:
+                    self.folders.pop(wd, None)
+                elif mask & IN_MOVE_SELF:
+                    self.remove_tree(folder)
+                elif mask & IN_ISDIR and mask & (IN_MOVED_FROM | IN_DELETE):
+                    self.remove_tree(path)
+                    changed.add(path)
+                elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+                    changed.add(path)
+        return changed
+
+
+class PollingWatcher:
+    """
+    Same as InotifyWatcher, but lists all folders of the paths again and
+    compares the files (with size and mtime) every time it is asked
+    """
+    def __init__(self, paths):
+        self.paths = paths
+        self.state = self.scan()
+
+    def close(self):
+        pass
+
+    def scan(self):
+        state = {}
+        for path in self.paths:
+            for root, folders, files in walk(path):
+                try:
+                    state[root] = IndexCache.list_dir(root)
+                except OSError:
+                    continue
+        return state
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        state = self.scan()
+        changed = {folder for folder in state.keys() | self.state.keys()
+                   if state.get(folder) != self.state.get(folder)}
+        self.state = state
+        return changed
 
 
-def test_if_file_there():
+def make_watcher(paths):
+    """
+    InotifyWatcher if possible, else PollingWatcher
+    """
+    try:
+        return InotifyWatcher(paths)
+    except OSError as e:
+        logging.info(f"No inotify ({e}), polling for changes\n")
+        return PollingWatcher(paths)
+
+
+class ModWatcher:
+    """
+    Watch mode: crawls once and then again every time one of the mods
+    changed (e.g. after a workshop update). The crawler stays in memory:
+    the character files are only parsed again if they changed, only the
+    indexes of changed mods are built again (with the index cache only
+    the changed folders are listed) and the RunManifest keeps the matches
+    of portraits whose candidates did not change.
+    """
+    def __init__(self, crawler, anime_mod_ids_to_crawl, file_types=None,
+                 criteria=contains_name, settle=2.0, watcher=None):
+        self.crawler = crawler
+        self.anime_mod_ids_to_crawl = anime_mod_ids_to_crawl
+        self.file_types = file_types
+        self.criteria = criteria
+        # seconds without changes before crawling again
+        self.settle = settle
+        self.watcher = watcher
+        config = crawler.config
+        self.paths = {}
+        for mod_id in [crawler.mod_id, crawler.anime_mod_id] + list(anime_mod_ids_to_crawl):
+            self.paths.setdefault(str(mod_id), config.mod_path(mod_id))
+        self.records = None
+        self.runs = 0
+        self.running = False
+
+    def changed_mods(self, folders):
+        return {mod_id for mod_id, path in self.paths.items()
+                for folder in folders if folder == path or folder.startswith(path + sep)}
+
+    def crawl(self):
+        start = perf_counter()
+        if self.records is None:
+            self.records = list(self.crawler.portrait_parser.iter_raw_portraits())
+        # missing_items.txt gives the last run only
+        self.crawler.missing.seek(0)
+        self.crawler.missing.truncate()
+        self.crawler.crawl_pipeline(self.anime_mod_ids_to_crawl, file_types=self.file_types,
+                                    criteria=self.criteria, records=self.records)
+        self.crawler.missing.flush()
+        self.runs += 1
+        logging.info(f"Watch: run {self.runs} took {perf_counter() - start:.2f} s\n")
+
+    def update(self, folders):
+        """
+        Crawls again after the given folders changed
+        """
+        mods = self.changed_mods(folders)
+        if len(mods) == 0:
+            return False
+        logging.info(f"Watch: {len(folders)} folders of {sorted(mods)} changed\n")
+        # a changed mod root (after polling or lost events) can mean
+        # changed character files too
+        character_path = self.crawler.portrait_parser.character_path
+        if any(folder == character_path or folder.startswith(character_path + sep)
+               or character_path.startswith(folder + sep) for folder in folders):
+            self.records = None
+        dropped = self.crawler.forget(mods)
+        if hasattr(self.criteria, 'forget'):
+            self.criteria.forget(dropped)
+        self.crawl()
+        return True
+
+    def wait_for_changes(self, watcher):
+        """
+        Waits for changes and then until the mods did not change for
+        settle seconds (a workshop update writes many files)
+        """
+        folders = watcher.changes(self.settle)
+        if len(folders) == 0:
+            return folders
+        while True:
+            more = watcher.changes(self.settle)
+            if len(more) == 0:
+                return folders
+            folders |= more
+
+    def run(self, max_runs=None):
+        """
+        Crawls and watches until stop() is called (or max_runs crawls).
+        If the watcher fails (e.g. no inotify watches left for new
+        folders) it goes on with a PollingWatcher.
+        """
+        paths = list(self.paths.values())
+        watcher = self.watcher
+        if watcher is None:
+            watcher = make_watcher(paths)
+        self.running = True
+        try:
+            self.crawl()
+            while self.running and (max_runs is None or self.runs < max_runs):
+                try:
+                    folders = self.wait_for_changes(watcher)
+                except OSError as e:
+                    logging.info(f"Watch: {e}, polling for changes\n")
+                    if watcher is not self.watcher:
+                        watcher.close()
+                    watcher = PollingWatcher(paths)
+                    # changes since the last events are not known
+                    folders = set(paths)
+                if len(folders) > 0:
+                    self.update(folders)
+        finally:
+            if watcher is not self.watcher:
+                watcher.close()
+            self.running = False
+
+    def stop(self):
+        self.running = False
+
+
+class PortraitService:
+    """
+    Answers "is there a replacement for this portrait?" with the indexes
+    of the crawler kept in memory. The anime mods are asked in the given
+    order with every criteria (by default same_name, then contains_name).
+    Counts requests and the latency of the look ups.
+    """
+    def __init__(self, crawler, anime_mod_ids_to_crawl=None, criteria=None,
+                 file_types=None):
+        if anime_mod_ids_to_crawl is None:
+            anime_mod_ids_to_crawl = [crawler.anime_mod_id]
+        if criteria is None:
+            criteria = [same_name, contains_name]
+        if file_types is None:
+            file_types = FILE_TYPES
+        self.crawler = crawler
+        self.anime_mod_ids_to_crawl = anime_mod_ids_to_crawl
+        self.criteria = criteria
+        self.file_types = file_types
+        # KR portraits are not sorted by role
+        self.use_roles = not isinstance(crawler, ModCrawlerKR)
+        self.mod_names = {str(mod_id): name for name, mod_id in tag_list.items()}
+        self.lock = Lock()
+        self.started = perf_counter()
+        self.requests = 0
+        self.lookups = 0
+        self.found = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        # latencies of the last look ups for the percentiles
+        self.latencies = deque(maxlen=1000)
+
+    def warm(self):
+        """
+        Builds all indexes, so the first look ups are fast too
+        """
+        self.crawler.get_snapshot(self.crawler.anime_mod_id)
+        for mod_id in self.anime_mod_ids_to_crawl:
+            for file_type in self.file_types:
+                self.crawler.get_index(mod_id, file_type)
+
+    def file_type_of(self, path):
+        """
+        File type of path (None if it is none of file_types)
+        """
+        for file_type in self.file_types:
+            if path.lower().endswith(file_type) and len(split(path)[1]) > len(file_type):
+                return file_type
+        return None
+
+    def check_path(self, path):
+        """
+        Gives back why path can not be looked up (None if it can)
+        """
+        if not isinstance(path, str):
+            return f"path has to be a string, not {type(path).__name__}"
+        if self.file_type_of(path) is None:
+            return f"{path} is no {'/'.join(self.file_types)} file"
+        return None
+
+    def lookup(self, path):
+        """
+        Looks a portrait up (path relative to the mod, e.g.
+        gfx/leaders/MEX/Portrait_MEX_Lazaro_Cardenas.dds) and gives back
+        a dict for JSON. Raises ValueError for paths which are not one of
+        the file types.
+        """
+        error = self.check_path(path)
+        if error is not None:
+            raise ValueError(error)
+        start = perf_counter()
+        config = self.crawler.config
+        rel_path = normpath(path).lstrip(sep)
+        folder, file1 = split(rel_path)
+        file_type = self.file_type_of(file1)
+        anime_mod_id = self.crawler.anime_mod_id
+        result = {'path': path, 'found': False, 'present': False, 'match': None,
+                  'full_path': None, 'mod_id': None, 'mod': None, 'criteria': None}
+        if rel_path in self.crawler.get_snapshot(anime_mod_id):
+            result['present'] = True
+        root1 = join(config.mod_path(anime_mod_id), folder) if self.use_roles else None
+        for mod_id in self.anime_mod_ids_to_crawl:
+            for criteria in self.criteria:
+                root2, file2 = self.crawler.find_alternative(root1, file1, criteria,
+                                                             anime_mod_id=mod_id,
+                                                             file_type=file_type)
+                if root2 is None:
+                    continue
+                full_path = join(root2, file2)
+                result.update(found=True, full_path=full_path,
+                              match=strip_prefix(full_path, config.mod_path(mod_id) + sep),
+                              mod_id=str(mod_id), mod=self.mod_names.get(str(mod_id)),
+                              criteria=criteria_key(criteria))
+                break
+            if result['found']:
+                break
+        elapsed = perf_counter() - start
+        with self.lock:
+            self.lookups += 1
+            self.found += int(result['found'])
+            self.seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            self.latencies.append(elapsed)
+        return result
+
+    def lookup_many(self, paths):
+        return [self.lookup(path) for path in paths]
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def stats(self):
+        with self.lock:
+            uptime = perf_counter() - self.started
+            latencies = sorted(self.latencies)
+            stats = {'requests': self.requests, 'lookups': self.lookups,
+                     'found': self.found, 'uptime': round(uptime, 3),
+                     'lookups_per_second': round(self.lookups / uptime, 2) if uptime > 0 else None,
+                     'latency_ms': None}
+            if self.lookups > 0:
+                stats['latency_ms'] = {
+                    'mean': round(1000 * self.seconds / self.lookups, 3),
+                    'max': round(1000 * self.max_seconds, 3),
+                    'p50': round(1000 * latencies[len(latencies) // 2], 3),
+                    'p95': round(1000 * latencies[int(len(latencies) * 0.95)], 3)}
+        return stats
+
+
+def make_request_handler(service):
+    """
+    HTTP handler for a PortraitService:
+    GET /lookup?path=... (path can be given several times), POST /lookup
+    with {"path": ...} or {"paths": [...]}, GET /stats
+    """
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qs
+
+    class PortraitRequestHandler(BaseHTTPRequestHandler):
+        def address_string(self):
+            # Unix sockets have no client address
+            return str(self.client_address[0]) if self.client_address else 'local'
+
+        def log_message(self, format, *args):
+            logging.debug("%s " + format, self.address_string(), *args)
+
+        def send_json(self, data, status=200):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def answer(self, paths, single):
+            if len(paths) == 0:
+                self.send_json({'error': 'no path given'}, 400)
+                return
+            for path in paths:
+                error = service.check_path(path)
+                if error is not None:
+                    self.send_json({'error': error}, 400)
+                    return
+            results = service.lookup_many(paths)
+            self.send_json(results[0] if single else {'results': results})
+
+        def do_GET(self):
+            service.count_request()
+            url = urlsplit(self.path)
+            if url.path == '/stats':
+                self.send_json(service.stats())
+            elif url.path == '/lookup':
+                paths = parse_qs(url.query).get('path', [])
+                self.answer(paths, len(paths) == 1)
+            else:
+                self.send_json({'error': 'not found'}, 404)
+
+        def do_POST(self):
+            service.count_request()
+            if urlsplit(self.path).path != '/lookup':
+                self.send_json({'error': 'not found'}, 404)
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                data = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError as e:
+                self.send_json({'error': f'invalid JSON: {e}'}, 400)
+                return
+            if not isinstance(data, dict):
+                self.send_json({'error': 'expected {"path": ...} or {"paths": [...]}'}, 400)
+            elif 'paths' in data:
+                if not isinstance(data['paths'], list):
+                    self.send_json({'error': 'paths has to be a list'}, 400)
+                    return
+                self.answer(data['paths'], False)
+            else:
+                self.answer([data['path']] if 'path' in data else [], True)
+
+    return PortraitRequestHandler
+
+
+def parse_address(address):
+    """
+    (path, None) for a Unix socket (unix:/path or anything with a /),
+    otherwise (host, port). Raises ValueError if there is no valid port or
+    something else than a socket is at the path.
+    """
+    if address.startswith('unix:') or '/' in address:
+        path = strip_prefix(address, 'unix:')
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            return path, None
+        if not S_ISSOCK(mode):
+            raise ValueError(f"{path} is already there and not a socket")
+        return path, None
+    host, _, port = address.rpartition(':')
+    if not port.isdigit() or int(port) > 65535:
+        raise ValueError(f"{address} is neither host:port nor a socket path")
+    return host or '127.0.0.1', int(port)
+
+
+def make_server(service, address="127.0.0.1:8356"):
+    """
+    Threaded HTTP server for a PortraitService on host:port, or on a Unix
+    socket if address is a path (see parse_address). An old socket at the
+    path is removed, any other file is left alone (ValueError).
+    """
+    import socketserver
+    from http.server import ThreadingHTTPServer
+    handler = make_request_handler(service)
+    host, port = parse_address(address)
+    if port is None:
+        if os.path.lexists(host):
+            unlink(host)
+
+        class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        return UnixHTTPServer(host, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class CoverageMatrix:
+    """
+    Share of the portraits of main mods which anime mods have under the
+    same path (exact), under another name found by criteria (fuzzy) or
+    not at all (missing), by country tag and role.
+    The portraits of every main mod and the files of every anime mod are
+    collected once, all combinations are then evaluated with set
+    operations on them (only the portraits not found exactly are looked
+    up in the indexes).
+    """
+    COLUMNS = ['main_mod', 'anime_mod', 'tag', 'role', 'total', 'exact', 'fuzzy', 'missing']
+    ALL = 'ALL'
+
+    def __init__(self, main_mods=None, anime_mods=None, criteria=contains_name,
+                 file_types=None, config=None):
+        if main_mods is None:
+            main_mods = MAIN_MOD_TAGS
+        if anime_mods is None:
+            anime_mods = ANIME_MOD_TAGS
+        if file_types is None:
+            file_types = FILE_TYPES
+        if config is None:
+            config = CrawlerConfig(use_cache=False)
+        self.config = config
+        # (name, mod id) of the mods which are there
+        self.main_mods = [mod for mod in map(self.available, main_mods) if mod is not None]
+        self.anime_mods = [mod for mod in map(self.available, anime_mods) if mod is not None]
+        self.criteria = criteria
+        self.file_types = file_types
+        self.indexes = {}
+        self.rows = []
+        # main mod -> anime mods in the order which covers most portraits first
+        self.order = {}
+
+    def available(self, mod):
+        """
+        (name, mod id) of a mod (tag or id) if it is in the workshop folder
+        """
+        mod_id = resolve_mod_id(mod)
+        if not os.path.isdir(self.config.mod_path(mod_id)):
+            logging.info(f"Coverage: {mod} is not there, skipped\n")
+            return None
+        return str(mod), mod_id
+
+    def strip_type(self, path):
+        for file_type in self.file_types:
+            if path.lower().endswith(file_type):
+                return path[:-len(file_type)]
+        return path
+
+    @staticmethod
+    def tag_and_role(rel_path, tag=None):
+        parts = normpath(rel_path).split(sep)
+        role = next((role for role in ROLES if role in parts[:-1]), MISC_KEY)
+        if tag is None:
+            tag = MISC_KEY
+            if role != MISC_KEY and parts.index(role) + 2 < len(parts):
+                tag = parts[parts.index(role) + 1]
+        return tag, role
+
+    def requirements(self, mod_id):
+        """
+        {path in the mod without file type: (tag, role)} of all portraits
+        of a main mod
+        """
+        required = {}
+        if mod_id == KAISERREICH_ID:
+            crawler = ModCrawlerKR(mod_id, mod_id, config=self.config,
+                                   missing_list_file=os.devnull)
+            for texture in crawler.parse_list().values():
+                path = normpath(self.strip_type(texture))
+                required.setdefault(path, self.tag_and_role(path))
+            return required
+
+        parser = PortraitParser(mod_id, config=self.config)
+        for record in parser.iter_raw_portraits():
+            path = normpath(self.strip_type(parser.replace_path(record.path, record.tag, '')))
+            required.setdefault(path, self.tag_and_role(path, record.tag))
+        return required
+
+    def mod_files(self, mod_id):
+        """
+        Paths without file type of all portrait files of an anime mod
+        (the mod is indexed with the same walk)
+        """
+        snapshot, indexes = scan_mod(self.config.mod_path(mod_id), self.file_types,
+                                     walker=self.config.walk, paths=self.config.paths)
+        for file_type, index in indexes.items():
+            self.indexes.setdefault((str(mod_id), file_type), index)
+        return {self.strip_type(path) for path in snapshot.files
+                if path.lower().endswith(tuple(self.file_types))}
+
+    def get_index(self, mod_id, file_type):
+        key = (str(mod_id), file_type)
+        if key not in self.indexes:
+            _, indexes = scan_mod(self.config.mod_path(mod_id),
+                                  dict.fromkeys([*self.file_types, file_type]),
+                                  snapshot=False, walker=self.config.walk,
+                                  paths=self.config.paths)
+            for found_type, index in indexes.items():
+                self.indexes.setdefault((str(mod_id), found_type), index)
+        return self.indexes[key]
+
+    def evaluate(self, required, files, mod_id):
+        """
+        Sets of the required paths found exact and found by criteria
+        """
+        exact = required.keys() & files
+        fuzzy = set()
+        mod_path = self.config.mod_path(mod_id)
+        for path in required.keys() - exact:
+            folder, stem = split(path)
+            root1 = join(mod_path, folder)
+            for file_type in self.file_types:
+                if self.get_index(mod_id, file_type).find(stem, self.criteria, root1) is not None:
+                    fuzzy.add(path)
+                    break
+        return exact, fuzzy
+
+    def add_rows(self, main_name, anime_name, required, exact, fuzzy):
+        counts = {}
+        for path, (tag, role) in required.items():
+            found = 'exact' if path in exact else 'fuzzy' if path in fuzzy else 'missing'
+            for key in [(tag, role), (tag, self.ALL), (self.ALL, role), (self.ALL, self.ALL)]:
+                count = counts.setdefault(key, Counter())
+                count['total'] += 1
+                count[found] += 1
+        for (tag, role), count in sorted(counts.items()):
+            self.rows.append({'main_mod': main_name, 'anime_mod': anime_name,
+                              'tag': tag, 'role': role, 'total': count['total'],
+                              'exact': count['exact'], 'fuzzy': count['fuzzy'],
+                              'missing': count['missing']})
+
+    def compute(self):
+        files = {mod_id: self.mod_files(mod_id) for _, mod_id in self.anime_mods}
+        for main_name, main_id in self.main_mods:
+            required = self.requirements(main_id)
+            covered = {}
+            for anime_name, anime_id in self.anime_mods:
+                exact, fuzzy = self.evaluate(required, files[anime_id], anime_id)
+                self.add_rows(main_name, anime_name, required, exact, fuzzy)
+                covered[anime_name] = exact | fuzzy
+            self.order[main_name] = self.best_order(covered, len(required))
+        return self.rows
+
+    @staticmethod
+    def best_order(covered, total):
+        """
+        Greedy source order: always the anime mod which adds the most
+        portraits, with the share covered so far
+        """
+        order = []
+        found = set()
+        left = dict(covered)
+        while left:
+            name = max(left, key=lambda name: len(left[name] - found))
+            found |= left.pop(name)
+            order.append({'anime_mod': name,
+                          'covered': round(len(found) / total, 4) if total > 0 else None})
+        return order
+
+    def write(self, file_name):
+        """
+        Writes the matrix as CSV, or as JSON (with the source orders) if
+        file_name ends with .json
+        """
+        if file_name.endswith('.json'):
+            with open(file_name, 'w', encoding='utf-8') as filep:
+                json.dump({'rows': self.rows, 'order': self.order}, filep, indent=2)
+            return
+        with open(file_name, 'w', encoding='utf-8', newline='') as filep:
+            writer = csv.DictWriter(filep, fieldnames=self.COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+
+def test_if_file_there(crawler):
     root1 = '/home/maldun/.local/share/Steam/steamapps/workshop/content/394360/820260968/gfx/interface/techtree'
     file1 = 'techtree_tank_tab.dds'
     assert crawler.check_if_file_there(root1, file1) is True
 
-def test_if_file_there2():
+def test_if_file_there2(crawler):
     root1 = '/home/maldun/.local/share/Steam/steamapps/workshop/content/394360/820260968/gfx/leaders/MEX/'
     file1 = 'Portrait_MEX_Lazaro_Cardenas.dds'
     assert not crawler.check_if_file_there(root1, file1) is True
@@ -456,13 +3551,13 @@ def test_lax_file_compare():
     file_name2 = "Portrait_MEX_Lazaro_Cardenas"
     assert contains_name(file_name1, file_name2)
 
-def test_find_alternative():
+def test_find_alternative(crawler):
     root1 = '/home/maldun/.local/share/Steam/steamapps/workshop/content/394360/820260968/gfx/leaders/MEX/'
     file1 = 'Portrait_MEX_Lazaro_Cardenas.dds'
     root2, file2 = crawler.find_alternative(root1, file1, contains_name)
     assert file2 == 'Portrait_Mexico_Lazaro_Cardenas.dds'
 
-def test_find_replacement():
+def test_find_replacement(crawler):
     root1 = '/home/maldun/.local/share/Steam/steamapps/workshop/content/394360/820260968/gfx/leaders/MEX/'
     file1 = 'Portrait_MEX_Lazaro_Cardenas.dds'
     result = crawler.find_replacement(root1, file1, crawler.anime_mod_id,
@@ -471,85 +3566,242 @@ def test_find_replacement():
     assert result[2] == 'Portrait_Mexico_Lazaro_Cardenas.dds'
     assert result[0] == file1
 
-def test_parse_file():
-    #file = f"{mod_id}/common/characters/LAT.txt"
-    file = f"{mod_id}/common/characters/MAF+ characters.txt"
-    var = "large"
-    expr = f'{var}(\s*)=(\s*)\"(.*)\"'
-    result = portrait_parser.parse_file_for_expression(file, expr)
+def test_parse_file(portrait_parser):
+    #file = f"{portrait_parser.mod_path}/common/characters/LAT.txt"
+    file = f"{portrait_parser.mod_path}/common/characters/MAF+ characters.txt"
+    result = [path for size, path in portrait_parser.parse_file(file) if size == "large"]
     
     assert len(result) == 17
 
-def test_replace_path():
-    #file = f"{mod_id}/common/characters/LAT.txt"
-    file = f"{mod_id}/common/characters/MAF+ characters.txt"
-    var = "large"
-    expr = f'{var}(\s*)=(\s*)\"(.*)\"'
-    result = portrait_parser.parse_file_for_expression(file, expr)
+def test_replace_path(portrait_parser):
+    #file = f"{portrait_parser.mod_path}/common/characters/LAT.txt"
+    file = f"{portrait_parser.mod_path}/common/characters/MAF+ characters.txt"
+    result = [path for size, path in portrait_parser.parse_file(file) if size == "large"]
     fname = result[0]
     result = portrait_parser.replace_path(fname, "LAT")
     assert 'gfx/leaders/LAT/Portrait_latvia_karlis_ulmanis.dds' == result
 
-def test_replace_paths():
-    file = f"{mod_id}/common/characters/LAT.txt"
-    var = "large"
-    expr = f'{var}(\s*)=(\s*)\"(.*)\"'
-    paths = portrait_parser.parse_file_for_expression(file, expr)
+def test_replace_paths(portrait_parser):
+    file = f"{portrait_parser.mod_path}/common/characters/LAT.txt"
+    paths = [path for size, path in portrait_parser.parse_file(file) if size == "large"]
     result = portrait_parser.replace_paths(paths, "LAT.txt")
     assert all([res.startswith("gfx") and res.endswith(portrait_parser.pfile_type)
                 for res in result])
 
-def test_portrait_list():
-    result = portrait_parser._portrait_list()
+def test_portrait_list(portrait_parser):
+    result = list(portrait_parser.iter_portraits())
     result2 = portrait_parser.portrait_list()
     assert len(result) == len(result2)
-    assert all([r.startswith(join(hoi4_path, str(mod_id))) for r in result2])
+    assert all([r.startswith(portrait_parser.mod_path) for r in result2])
 
-def test_filter_missing_files():
-    result = crawler.filter_missing_files(anime_mod_id)
-    result2 = portrait_parser.portrait_list()
+def test_filter_missing_files(crawler):
+    result = crawler.filter_missing_files(crawler.anime_mod_id)
+    result2 = crawler.portrait_parser.portrait_list()
     assert len(result) < len(result2)
     
-def test_parse_portraits():
+def test_parse_portraits(crawler):
     result = crawler.parse_list()
     isinstance(result, dict)
 
-def test_search_for_alternatives():
+def test_search_for_alternatives(crawler):
     items = crawler.parse_list()
     alts, not_found = crawler.search_for_alternatives(items)
 
-def test_crawl():
+def test_crawl(crawler):
     crawler.crawl()
 
-TEST = True
-if TEST:
-    # test_if_file_there()
-    # test_if_file_there2()
+def run_self_tests(crawler):
+    portrait_parser = crawler.portrait_parser
+    # test_if_file_there(crawler)
+    # test_if_file_there2(crawler)
     test_lax_file_compare()
-    #test_find_alternative()
-    #test_find_replacement()
-    #test_parse_file()
-    #test_replace_path()
-    #test_replace_paths()
-    #test_portrait_list()
-    #test_filter_missing_files()
-    test_search_for_alternatives()
-    test_parse_portraits()
-    test_crawl()
-    exit(0)
-    
-    
+    #test_find_alternative(crawler)
+    #test_find_replacement(crawler)
+    #test_parse_file(portrait_parser)
+    #test_replace_path(portrait_parser)
+    #test_replace_paths(portrait_parser)
+    #test_portrait_list(portrait_parser)
+    #test_filter_missing_files(crawler)
+    test_search_for_alternatives(crawler)
+    test_parse_portraits(crawler)
+    test_crawl(crawler)
+
+
+def make_crawler(mod_id, anime_mod_id, config=None, **kwargs):
+    """
+    Creates the right crawler for the main mod
+    """
+    if mod_id == KAISERREICH_ID:
+        return ModCrawlerKR(mod_id, anime_mod_id, config=config, **kwargs)
+    return ModCrawler(mod_id, anime_mod_id, config=config, **kwargs)
+
+
+def build_arg_parser():
+    desc = 'Find missing files. Supported Mod tags: \n'
+    desc += ', '.join(tag_list.keys()) 
+    desc += " (if the tag is not listed just provide the id as number)"
+
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('mod_id', metavar='mod_id', type=str, nargs='?',
+                        help='Main mod to look at')
+    parser.add_argument('anime_mod_id', metavar='anime_mod_id', type=str, nargs='?',
+                        help='Anime mod to look at')
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f'Walk and parse everything instead of using {INDEX_CACHE_FILE}')
+    parser.add_argument('--jobs', metavar='N', type=int, default=1,
+                        help='Parse character and .gfx files with N processes')
+    parser.add_argument('--link', choices=LINK_MODES, default='copy',
+                        help='Hardlink or reflink found files instead of copying them (if on the same file system)')
+    parser.add_argument('--copy-jobs', metavar='N', type=int, default=4,
+                        help='Number of threads which copy the found files')
+    parser.add_argument('--async', dest='async_jobs', metavar='N', type=int, nargs='?',
+                        const=4, default=None,
+                        help='Scan, index and parse the mods at the same time with N threads (default 4)')
+    parser.add_argument('--fuzzy', metavar='THRESHOLD', type=float, nargs='?',
+                        const=0.8, default=None,
+                        help='Use fuzzy name matching (score between 0 and 1, default 0.8)')
+    parser.add_argument('--image-match', metavar='DISTANCE', type=int, nargs='?',
+                        const=6, default=None,
+                        help='Find portraits the anime mod has under another name by image hash (needs numpy and Pillow)')
+    parser.add_argument('--package', metavar='PATH', default=None,
+                        help='Write the found portraits with sprite definitions as submod folder (or .zip) instead of diff folders')
+    parser.add_argument('--check-images', action='store_true',
+                        help='Skip broken images and prefer images of the right size (reads only the DDS/PNG headers)')
+    parser.add_argument('anime_mod_id_to_crawl', metavar='anime_mod_id_to_crawl',
+                        type=str, nargs='*',
+                        help='''Anime mod(s) to crawl. Either one or several. 
+                        If none is given anime_mod_id is used''',
+                        default=[],
+                        )
+    parser.add_argument('--self-test', action='store_true',
+                        help='Run the built in tests against the given mods')
+    parser.add_argument('--metrics', metavar='FILE', default=None,
+                        help='Write time, files and bytes per stage and the cache hit rates as JSON')
+    parser.add_argument('--profile', metavar='FILE', nargs='?', const='crawler.prof',
+                        default=None,
+                        help='Write a cProfile dump of the crawl (default crawler.prof)')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log every found and copied file to crawler.log')
+    parser.add_argument('--watch', metavar='SECONDS', type=float, nargs='?',
+                        const=2.0, default=None,
+                        help='Keep running and crawl again when the mods change (after SECONDS without changes, default 2)')
+    parser.add_argument('--serve', metavar='ADDRESS', nargs='?', const='127.0.0.1:8356',
+                        default=None,
+                        help='Answer look ups over HTTP on host:port (default 127.0.0.1:8356) or a Unix socket path')
+    parser.add_argument('--coverage', metavar='FILE', default=None,
+                        help="""Write how many portraits of each main mod the anime mods have
+                        (exact, fuzzy, missing by tag and role) as CSV or JSON (.json).
+                        Uses the given mods or all mods of the tag list""")
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    arguments = parser.parse_args(argv)
+    if arguments.coverage is None and arguments.anime_mod_id is None:
+        parser.error("mod_id and anime_mod_id are needed")
+    if arguments.package is not None and (arguments.watch is not None or arguments.serve is not None):
+        parser.error("--package can not be used with --watch or --serve")
+    if arguments.serve is not None:
+        try:
+            parse_address(arguments.serve)
+        except ValueError as e:
+            parser.error(str(e))
+    # every single file is only logged with --verbose, it slows big crawls down
+    level = logging.DEBUG if arguments.verbose else logging.INFO
+    logging.basicConfig(filename='crawler.log', encoding='utf-8', level=level)
+
+    # base = expanduser('~/.local/share/Steam/steamapps/workshop/content/')
+    # hoi4_path = join(base, str(HOI4_ID))
+    config = CrawlerConfig.from_arguments(arguments, hoi4_path=getcwd())
+
+    criteria = contains_name if arguments.fuzzy is None else FuzzyMatcher(arguments.fuzzy)
+    if arguments.coverage is not None:
+        main_mods = None if arguments.mod_id is None else [arguments.mod_id]
+        anime_mods = None
+        if arguments.anime_mod_id is not None:
+            anime_mods = [arguments.anime_mod_id] + arguments.anime_mod_id_to_crawl
+        matrix = CoverageMatrix(main_mods, anime_mods, criteria=criteria, config=config)
+        matrix.compute()
+        matrix.write(arguments.coverage)
+        config.close()
+        return 0
+
+    mod_id = resolve_mod_id(arguments.mod_id)
+    anime_mod_id = resolve_mod_id(arguments.anime_mod_id)
+    anime_mod_ids_to_crawl = [anime_mod_id]
+    anime_mod_ids_to_crawl += [resolve_mod_id(mid) for mid in arguments.anime_mod_id_to_crawl]
+
+    if arguments.self_test:
+        crawler = make_crawler(mod_id, anime_mod_id, config=config, file_type='.png')
+        run_self_tests(crawler)
+        return 0
 
-if __name__ == "__main__":
     logging.info("Crawl {}\n".format(anime_mod_id))
-    for file_type in [".png", ".dds"]:
-        logging.info(f"Crawl for {file_type}")
-        portrait_parser = PortraitParser(mod_id, pfile_type=file_type)
-        crawler = ModCrawlerKR(mod_id, anime_mod_id, file_type=file_type) if mod_id == KAISERREICH_ID else ModCrawler(mod_id, anime_mod_id, file_type=file_type)
-        #crawler.crawl()
-        for k, mid in enumerate(anime_mod_ids_to_crawl):
-            logging.info("Lax Crawl {} Mod Nr:{}\n".format(mid, k))
-            #crawler.crawl(anime_mod_id_to_crawl=mid,
-            #            suff=f"_v{k}", write=False,
-            #            criteria=contains_name)
-            crawler.add_missing_portraits(mid)
+    image_matcher = None
+    if arguments.image_match is not None:
+        image_matcher = ImageMatcher(arguments.image_match, jobs=config.jobs,
+                                     parse_cache=config.get_parse_cache())
+    validator = None
+    if arguments.check_images:
+        validator = ImageValidator(metrics=config.metrics)
+    package = None
+    if arguments.package is not None:
+        package = ModPackage(arguments.package, config=config)
+    crawler = make_crawler(mod_id, anime_mod_id, config=config,
+                           file_type=FILE_TYPES[0], image_matcher=image_matcher,
+                           validator=validator, copy_plan=package)
+    logging.info("Lax Crawl {}\n".format(anime_mod_ids_to_crawl))
+    if arguments.serve is not None:
+        criteria_list = [same_name, criteria]
+        service = PortraitService(crawler, anime_mod_ids_to_crawl, criteria=criteria_list)
+        service.warm()
+        server = make_server(service, arguments.serve)
+        logging.info(f"Serving look ups on {arguments.serve}\n")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        config.close()
+        return 0
+
+    if arguments.watch is not None:
+        watcher = ModWatcher(crawler, anime_mod_ids_to_crawl, file_types=FILE_TYPES,
+                             criteria=criteria, settle=arguments.watch)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        config.close()
+        return 0
+
+    if arguments.async_jobs is None:
+        crawl = partial(crawler.add_missing_portraits_multi, anime_mod_ids_to_crawl,
+                        file_types=FILE_TYPES, criteria=criteria)
+    else:
+        import asyncio
+        crawl = partial(asyncio.run, crawler.add_missing_portraits_async(
+            anime_mod_ids_to_crawl, file_types=FILE_TYPES, criteria=criteria))
+
+    if arguments.profile is None:
+        crawl()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(crawl)
+        profiler.dump_stats(arguments.profile)
+    if package is not None:
+        crawler.write_package(package)
+
+    summary = config.metrics_summary()
+    logging.info("Metrics: %s", json.dumps(summary))
+    if arguments.metrics is not None:
+        with open(arguments.metrics, 'w', encoding='utf-8') as filep:
+            json.dump(summary, filep, indent=2)
+    config.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the anime mod crawler on generated mod trees.
+
+A fake workshop folder is created with a main mod (character files and
+portraits), anime mods which have a part of the portraits under the same
+name, a part under a changed name and miss the rest, and a Kaiserreich
+style mod with .gfx sprite files. Then the main steps of the crawler are
+timed for each size and the throughput and peak memory are reported.
+
+python benchmark.py --sizes 1000 10000 100000
+"""
+
+from os import makedirs, getcwd, chdir
+from os.path import join
+import sys
+import argparse
+import importlib
+import json
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import anime_mod_crawler as amc
+
+
+MAIN_ID = amc.ROAD_TO_56_ID
+ANIME_IDS = [amc.ROAD_ANIME_ID, amc.ANIME_HISTORY_ID]
+KR_ID = amc.KAISERREICH_ID
+SIZES = [1000, 10000, 100000]
+ROLES = ['leaders', 'ministers', 'advisors']
+FIRST_NAMES = ['anna', 'karl', 'jean', 'otto', 'maria', 'lazaro', 'hans', 'ivan',
+               'sofia', 'pedro', 'erich', 'yuki', 'li', 'omar', 'clara', 'juan']
+# surnames are built from these syllables, all with the same length so no
+# name is part of another one
+SYLLABLES = ['ka', 'to', 'ri', 'mu', 'se', 'no', 'ha', 'yu',
+             'be', 'lo', 'ga', 'di', 'ne', 'po', 'sa', 'ku']
+SURNAME_LENGTH = 5
+PORTRAITS_PER_GFX = 100
+# fake image content (DDS magic + padding)
+IMAGE_DATA = b'DDS ' + bytes(124)
+
+
+def make_tag(k):
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return letters[k // 676 % 26] + letters[k // 26 % 26] + letters[k % 26]
+
+
+def make_surname(k):
+    syllables = []
+    for _ in range(SURNAME_LENGTH):
+        k, digit = divmod(k, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+    return ''.join(syllables)
+
+
+def make_name(k):
+    return f"{FIRST_NAMES[k % len(FIRST_NAMES)]}_{make_surname(k)}"
+
+
+def add_noise(name, rng):
+    """
+    Changes the spelling of a name like the anime mods do
+    (capitals, dashes instead of underscores)
+    """
+    variant = rng.randrange(3)
+    if variant == 0:
+        return name.title()
+    if variant == 1:
+        return name.replace('_', '-')
+    return name.upper()
+
+
+def write_file(path, data=IMAGE_DATA):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class TreeGenerator:
+    """
+    Generates a workshop folder with n_files portraits in the main mod.
+    overlap is the share of portraits the anime mods have under the same
+    path, noise the share of the others they have under a changed name
+    (found by contains_name), the rest is missing.
+    """
+    def __init__(self, hoi4_path, n_files, overlap=0.5, noise=0.5,
+                 anime_mods=1, tags_per_1000=20, seed=0):
+        self.hoi4_path = hoi4_path
+        self.n_files = n_files
+        self.overlap = overlap
+        self.noise = noise
+        self.anime_ids = ANIME_IDS[:anime_mods]
+        self.n_tags = max(1, n_files * tags_per_1000 // 1000)
+        self.rng = random.Random(seed)
+        self.folders = set()
+
+    def mod_path(self, mod_id):
+        return join(self.hoi4_path, str(mod_id))
+
+    def write(self, path, data=IMAGE_DATA):
+        folder = path.rsplit('/', 1)[0]
+        if folder not in self.folders:
+            makedirs(folder, exist_ok=True)
+            self.folders.add(folder)
+        write_file(path, data)
+
+    def portraits(self):
+        """
+        (tag, role, name) of the portraits of the main mod; every character
+        has a large and a small portrait
+        """
+        for k in range(self.n_files // 2):
+            tag = make_tag(k % self.n_tags)
+            role = ROLES[0] if k % 4 < 2 else ROLES[k % 4 - 1]
+            yield tag, role, make_name(k)
+
+    def make_main_mod(self):
+        mod_path = self.mod_path(MAIN_ID)
+        characters = {}
+        for tag, role, name in self.portraits():
+            large = f"Portrait_{tag}_{name}"
+            small = f"gfx/{role}/{tag}/small_{name}.dds"
+            self.write(join(mod_path, "gfx", "leaders", tag, large + ".dds"))
+            self.write(join(mod_path, small))
+            characters.setdefault(tag, []).append(
+                f"{tag}_{name} = {{\n\tportraits = {{\n\t\tcivilian = {{\n"
+                f"\t\t\tlarge = \"GFX_{large}\"\n\t\t\tsmall = \"{small}\"\n"
+                f"\t\t}}\n\t}}\n}}\n")
+
+        character_path = join(mod_path, "common", "characters")
+        makedirs(character_path, exist_ok=True)
+        for tag, entries in characters.items():
+            with open(join(character_path, tag + ".txt"), 'w', encoding='utf-8') as f:
+                f.write("characters = {\n" + ''.join(entries) + "}\n")
+
+    def make_anime_mod(self, anime_id):
+        mod_path = self.mod_path(anime_id)
+        for tag, role, name in self.portraits():
+            for rel_path in [join("gfx", "leaders", tag, f"Portrait_{tag}_{name}.dds"),
+                             join("gfx", role, tag, f"small_{name}.dds")]:
+                draw = self.rng.random()
+                if draw < self.overlap:
+                    self.write(join(mod_path, rel_path))
+                elif draw < self.overlap + (1 - self.overlap) * self.noise:
+                    folder = rel_path.rsplit('/', 1)[0]
+                    self.write(join(mod_path, folder,
+                                    f"anime_{add_noise(name, self.rng)}.dds"))
+
+    def make_kr_mod(self):
+        """
+        Kaiserreich style mod: the portraits are defined in .gfx files
+        """
+        mod_path = self.mod_path(KR_ID)
+        gfx_path = join(mod_path, amc.ModCrawlerKR.KR_PORTRAIT_FOLDER)
+        makedirs(gfx_path, exist_ok=True)
+        portraits = list(self.portraits())
+        for start in range(0, len(portraits), PORTRAITS_PER_GFX):
+            sprites = []
+            for tag, role, name in portraits[start:start + PORTRAITS_PER_GFX]:
+                texture = f"gfx/leaders/{tag}/Portrait_{tag}_{name}.dds"
+                self.write(join(mod_path, texture))
+                sprites.append(f"\tspriteType = {{\n\t\tname = \"GFX_{tag}_{name}_large\"\n"
+                               f"\t\ttexturefile = \"{texture}\"\n\t}}\n")
+            with open(join(gfx_path, f"portraits_{start // PORTRAITS_PER_GFX}.gfx"),
+                      'w', encoding='utf-8') as f:
+                f.write("spriteTypes = {\n" + ''.join(sprites) + "}\n")
+
+    def make(self):
+        self.make_main_mod()
+        for anime_id in self.anime_ids:
+            self.make_anime_mod(anime_id)
+        self.make_kr_mod()
+
+
+class Benchmark:
+    """
+    Runs the crawler steps on one generated tree. Each step is run once
+    for the time and once more with tracemalloc for the peak memory.
+    With use_cache the caches are filled by a first run which is not
+    counted.
+    """
+    def __init__(self, hoi4_path, n_files, use_cache=False, jobs=1, queries=1000):
+        self.hoi4_path = hoi4_path
+        self.n_files = n_files
+        self.use_cache = use_cache
+        self.jobs = jobs
+        self.queries = queries
+        self.results = []
+
+    def make_config(self):
+        return amc.CrawlerConfig(hoi4_path=self.hoi4_path, use_cache=self.use_cache,
+                                 jobs=self.jobs)
+
+    def make_crawler(self, config, cls=amc.ModCrawler, mod_id=MAIN_ID):
+        return cls(mod_id, ANIME_IDS[0], config=config)
+
+    def clean_output(self):
+        for anime_id in ANIME_IDS:
+            shutil.rmtree(join(self.hoi4_path, "diff" + str(anime_id)), ignore_errors=True)
+
+    def bench_portrait_list(self, config):
+        parser = amc.PortraitParser(MAIN_ID, config=config)
+        return lambda: len(parser.portrait_list())
+
+    def bench_filter_missing_files(self, config):
+        crawler = self.make_crawler(config)
+        return lambda: len(crawler.filter_missing_files(ANIME_IDS[0]))
+
+    def bench_find_alternative(self, config):
+        crawler = self.make_crawler(config)
+        # the index is built before, only the look ups are timed
+        crawler.get_index(ANIME_IDS[0])
+        names = [f"Portrait_AAA_{make_name(k)}.dds"
+                 for k in range(0, self.n_files // 2, max(1, self.n_files // 2 // self.queries))]
+        root = join(self.hoi4_path, str(MAIN_ID), "gfx", "leaders", "AAA")
+
+        def run():
+            for name in names:
+                crawler.find_alternative(root, name, amc.contains_name)
+            return len(names)
+        return run
+
+    def bench_add_missing_portraits(self, config):
+        self.clean_output()
+        crawler = self.make_crawler(config)
+
+        def run():
+            crawler.add_missing_portraits(ANIME_IDS[0])
+            return self.n_files
+        return run
+
+    def bench_kr_crawl(self, config):
+        # the .gfx files are read with Hoi4Converter
+        importlib.import_module('Hoi4Converter.converter')
+        self.clean_output()
+        crawler = self.make_crawler(config, cls=amc.ModCrawlerKR, mod_id=KR_ID)
+
+        def run():
+            crawler.crawl()
+            return self.n_files // 2
+        return run
+
+    BENCHMARKS = ['portrait_list', 'filter_missing_files', 'find_alternative',
+                  'add_missing_portraits', 'kr_crawl']
+
+    def measure(self, name, trace=False):
+        config = self.make_config()
+        run = getattr(self, 'bench_' + name)(config)
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        items = run()
+        elapsed = time.perf_counter() - start
+        peak = None
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        config.close()
+        return items, elapsed, peak
+
+    def run(self, names=None):
+        if names is None:
+            names = self.BENCHMARKS
+        for name in names:
+            try:
+                if self.use_cache:
+                    self.measure(name)
+                items, elapsed, _ = self.measure(name)
+                _, _, peak = self.measure(name, trace=True)
+            except ImportError as e:
+                # ModCrawlerKR needs Hoi4Converter
+                print(f"{name}: skipped ({e})")
+                continue
+            result = {'benchmark': name, 'files': self.n_files, 'items': items,
+                      'seconds': round(elapsed, 4),
+                      'items_per_second': round(items / elapsed, 1) if elapsed > 0 else None,
+                      'peak_mb': round(peak / 2**20, 2)}
+            self.results.append(result)
+            print(f"{name:22} {self.n_files:>7} files {items:>7} items "
+                  f"{elapsed:9.3f} s {result['items_per_second']:>12} items/s "
+                  f"{result['peak_mb']:>9} MB")
+        return self.results
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the crawler on generated mod trees')
+    parser.add_argument('--sizes', metavar='N', type=int, nargs='+', default=SIZES,
+                        help='Number of portraits in the main mod (default 1000 10000 100000)')
+    parser.add_argument('--overlap', type=float, default=0.5,
+                        help='Share of portraits the anime mod has under the same name')
+    parser.add_argument('--noise', type=float, default=0.5,
+                        help='Share of the other portraits the anime mod has under a changed name')
+    parser.add_argument('--anime-mods', type=int, default=1, choices=[1, 2],
+                        help='Number of generated anime mods')
+    parser.add_argument('--only', choices=Benchmark.BENCHMARKS, nargs='+', default=None,
+                        help='Run only these benchmarks')
+    parser.add_argument('--cache', action='store_true',
+                        help='Use the index and parse cache (measures warm runs)')
+    parser.add_argument('--jobs', metavar='N', type=int, default=1,
+                        help='Parse with N processes')
+    parser.add_argument('--dir', default=None,
+                        help='Generate the trees here and keep them (default: temporary folder)')
+    parser.add_argument('--json', metavar='FILE', default=None,
+                        help='Write the results as JSON')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def main(argv=None):
+    arguments = build_arg_parser().parse_args(argv)
+    base = arguments.dir
+    if base is None:
+        base = tempfile.mkdtemp(prefix='crawler_bench_')
+    cwd = getcwd()
+    results = []
+    try:
+        for n_files in arguments.sizes:
+            hoi4_path = join(base, str(n_files))
+            shutil.rmtree(hoi4_path, ignore_errors=True)
+            start = time.perf_counter()
+            TreeGenerator(hoi4_path, n_files, overlap=arguments.overlap,
+                          noise=arguments.noise, anime_mods=arguments.anime_mods,
+                          seed=arguments.seed).make()
+            print(f"Generated {n_files} files in {time.perf_counter() - start:.1f} s")
+            # the crawler writes its lists to the current folder
+            chdir(hoi4_path)
+            results += Benchmark(hoi4_path, n_files, use_cache=arguments.cache,
+                                 jobs=arguments.jobs).run(arguments.only)
+            chdir(cwd)
+    finally:
+        chdir(cwd)
+        if arguments.dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+    if arguments.json is not None:
+        with open(arguments.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import os
+import sys
+from os.path import abspath, dirname, join
+
+import pytest
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+NAMES = ['lazaro_cardenas', 'karl_stein', 'jean_gaulle', 'otto_bismarck']
+TAGS = ['MEX', 'GER']
+
+
+def write_file(path, content):
+    os.makedirs(dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as filep:
+        filep.write(content)
+
+
+@pytest.fixture
+def mod_tree(tmp_path, monkeypatch):
+    """
+    Workshop folder with the main mod 1 (character files), the anime mod 2
+    which has the first portrait of every country and the anime mods 3 and
+    4 to crawl. The crawler reports are written into it too.
+    """
+    base = str(tmp_path)
+    for tag in TAGS:
+        lines = [f'{name} = {{ portraits = {{ civilian = {{ large = "GFX_Portrait_{tag}_{name}" '
+                 f'small = "gfx/leaders/{tag}/small_{name}.dds" }} }} }}\n' for name in NAMES]
+        write_file(join(base, '1', 'common', 'characters', f'{tag}.txt'), ''.join(lines))
+        for name in NAMES:
+            write_file(join(base, '1', 'gfx', 'leaders', tag, f'Portrait_{tag}_{name}.dds'), name)
+        write_file(join(base, '2', 'gfx', 'leaders', tag, f'Portrait_{tag}_{NAMES[0]}.dds'), 'anime')
+        for name in NAMES[1:3]:
+            write_file(join(base, '3', 'gfx', 'leaders', tag, f'Portrait_{name}.dds'), f'{name} 3')
+        for name in NAMES[2:]:
+            write_file(join(base, '4', 'gfx', 'leaders', tag, f'{tag}_{name}.dds'), f'{name} 4')
+    monkeypatch.chdir(base)
+    return base
@@ -0,0 +1,87 @@
+import struct
+import zlib
+
+import anime_mod_crawler as amc
+
+
+def dds(width, height, fourcc=b'DXT5', bits=0, mipmaps=0, dxgi=None):
+    """
+    Header of a DDS file (with a DX10 header if dxgi is given)
+    """
+    head = bytearray(128)
+    head[:4] = amc.DDS_MAGIC
+    struct.pack_into('<I', head, 4, 124)
+    flags = 0x1007 | (amc.DDSD_MIPMAPCOUNT if mipmaps > 0 else 0)
+    struct.pack_into('<3I', head, 8, flags, height, width)
+    struct.pack_into('<I', head, 28, mipmaps)
+    pf_flags = amc.DDPF_FOURCC if fourcc is not None else 0x40
+    struct.pack_into('<I4sI', head, 80, pf_flags, fourcc or b'', bits)
+    if dxgi is not None:
+        head += struct.pack('<5I', dxgi, 3, 0, 1, 0)
+    return bytes(head)
+
+
+def chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def png(width=1, height=1):
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    data = zlib.compress(b'\0' * (1 + 4 * width) * height)
+    return amc.PNG_SIGNATURE + chunk(b'IHDR', ihdr) + chunk(b'IDAT', data) + chunk(b'IEND', b'')
+
+
+def header_of(tmp_path, content):
+    path = tmp_path / 'image'
+    path.write_bytes(content)
+    return amc.image_header(str(path))
+
+
+def test_dds_header():
+    data = amc.dds_data_size(156, 210, 1, block_size=16)
+    assert data == 39 * 53 * 16
+    header = amc.dds_header(dds(156, 210), 128 + data)
+    assert header == ('dds', 156, 210, 'DXT5', None)
+    assert amc.dds_header(dds(156, 210), 127 + data).error == f'cut off ({127 + data} of {128 + data} bytes)'
+
+
+def test_dds_header_formats():
+    assert amc.dds_data_size(4, 4, 3, block_size=8) == 3 * 8
+    header = amc.dds_header(dds(65, 67, fourcc=None, bits=32), 128 + 65 * 67 * 4)
+    assert header == ('dds', 65, 67, '32bit', None)
+    header = amc.dds_header(dds(65, 67, fourcc=b'DX10', dxgi=28), 148 + 65 * 67 * 4)
+    assert header == ('dds', 65, 67, 'DXGI28', None)
+    assert amc.dds_header(dds(65, 67, fourcc=b'DX10', dxgi=28)[:140], 148).error == 'header cut off'
+    # unknown formats are not checked for their size
+    assert amc.dds_header(dds(65, 67, fourcc=b'ABCD'), 128).error is None
+    assert amc.dds_header(dds(0, 67), 1000).error == 'no image size'
+
+
+def test_image_header_dds(tmp_path):
+    content = dds(8, 8) + b'\0' * amc.dds_data_size(8, 8, 1, block_size=16)
+    assert header_of(tmp_path, content) == ('dds', 8, 8, 'DXT5', None)
+    assert header_of(tmp_path, content[:-1]).error.startswith('cut off')
+    assert header_of(tmp_path, amc.DDS_MAGIC + b'\0' * 50).error == 'header cut off'
+
+
+def test_image_header_png(tmp_path):
+    content = png()
+    assert len(content) < amc.IMAGE_HEADER_SIZE
+    assert header_of(tmp_path, content) == ('png', 1, 1, 'rgba8', None)
+    assert header_of(tmp_path, png(156, 210)) == ('png', 156, 210, 'rgba8', None)
+    assert header_of(tmp_path, content + b'trailing data').error is None
+    assert header_of(tmp_path, content[:-4]).error == 'cut off (IEND missing)'
+    broken = content[:20] + b'\xff' + content[21:]
+    assert header_of(tmp_path, broken).error == 'IHDR broken'
+
+
+def test_image_header_other(tmp_path):
+    assert header_of(tmp_path, b'not an image').format is None
+    assert header_of(tmp_path, b'').error == 'no DDS or PNG file'
+
+
+def test_size_class():
+    assert amc.size_class(156, 210) == 'large'
+    assert amc.size_class(65, 67) == 'small'
+    assert amc.size_class(130, 130) == 'large'
+    assert amc.size_class(80, 80) == 'small'
@@ -0,0 +1,92 @@
+import os
+import shutil
+from os.path import join
+
+import anime_mod_crawler as amc
+from conftest import TAGS, write_file
+
+
+def crawl(base, use_cache=True, keep_output=False):
+    """
+    Crawls the mods 3 and 4 for the portraits mod 2 misses, gives back
+    ({output file: content}, manifest of the run or None)
+    """
+    out = join(base, 'diff2')
+    if not keep_output:
+        shutil.rmtree(out, ignore_errors=True)
+    manifests = []
+    with amc.CrawlerConfig(hoi4_path=base, use_cache=use_cache) as config:
+        get_manifest = config.get_manifest
+        config.get_manifest = lambda run: manifests.append(get_manifest(run)) or manifests[-1]
+        crawler = amc.ModCrawler(1, 2, config=config)
+        crawler.add_missing_portraits_multi([3, 4], file_types=['.dds'])
+        crawler.missing.close()
+    outputs = {}
+    for root, _, files in os.walk(out):
+        for file in files:
+            with open(join(root, file), encoding='utf-8') as filep:
+                outputs[os.path.relpath(join(root, file), out)] = filep.read()
+    return outputs, manifests[0] if manifests else None
+
+
+def test_add_index(tmp_path):
+    cache_file = str(tmp_path / 'cache.sqlite')
+    manifest = amc.RunManifest(cache_file, 'run')
+    assert manifest.add_index('index', ['a', 'b', 'c']) is None
+    manifest.save()
+    manifest.close()
+
+    manifest = amc.RunManifest(cache_file, 'run')
+    assert manifest.add_index('index', ['a', 'b', 'c']) == set()
+    assert manifest.add_index('index', ['a', 'x', 'b']) == {'c', 'x'}
+    # another walk order, the changes can't be told
+    assert manifest.add_index('index', ['b', 'a', 'c']) is None
+    manifest.close()
+
+
+def test_rerun_reuses_all_matches(mod_tree):
+    first, manifest = crawl(mod_tree)
+    assert manifest.reused == 0
+    assert len(manifest.new_matches) > 0
+    again, manifest = crawl(mod_tree)
+    assert manifest.reused == len(manifest.new_matches)
+    assert again == first
+
+
+def test_rerun_after_added_file_is_fresh_run(mod_tree):
+    crawl(mod_tree)
+    write_file(join(mod_tree, '3', 'gfx', 'leaders', 'GER', 'Portrait_otto_bismarck.dds'),
+               'otto_bismarck 3')
+    rerun, manifest = crawl(mod_tree)
+    assert 0 < manifest.reused < len(manifest.new_matches)
+    fresh, _ = crawl(mod_tree, use_cache=False)
+    assert rerun == fresh
+    # the first crawled mod gets the real name, the next one a suffix
+    assert rerun[join('gfx', 'leaders', 'GER', 'Portrait_GER_otto_bismarck.dds')] == 'otto_bismarck 3'
+    assert rerun[join('gfx', 'leaders', 'GER', 'Portrait_GER_otto_bismarck_v1.dds')] == 'otto_bismarck 4'
+
+
+def test_rerun_after_removed_file_is_fresh_run(mod_tree):
+    crawl(mod_tree)
+    os.remove(join(mod_tree, '3', 'gfx', 'leaders', 'MEX', 'Portrait_karl_stein.dds'))
+    rerun, manifest = crawl(mod_tree)
+    assert manifest.reused < len(manifest.new_matches)
+    fresh, _ = crawl(mod_tree, use_cache=False)
+    assert rerun == fresh
+
+
+def test_outputs_are_the_written_files(mod_tree):
+    outputs, manifest = crawl(mod_tree)
+    out = join(mod_tree, 'diff2')
+    assert set(manifest.new_outputs) == {join(out, path) for path in outputs}
+
+
+def test_rerun_rewrites_changed_art(mod_tree):
+    crawl(mod_tree)
+    for tag in TAGS:
+        write_file(join(mod_tree, '3', 'gfx', 'leaders', tag, 'Portrait_karl_stein.dds'), 'new art')
+    outputs, manifest = crawl(mod_tree, keep_output=True)
+    for tag in TAGS:
+        assert outputs[join('gfx', 'leaders', tag, f'Portrait_{tag}_karl_stein.dds')] == 'new art'
+    assert not any('_v0' in path for path in outputs)
+    assert set(manifest.new_outputs) == {join(mod_tree, 'diff2', path) for path in outputs}